@@ -0,0 +1,337 @@
+import os
+
+from abc import ABC, abstractmethod
+
+from cache import cached, get_cache
+from entity_store import open_entity_store
+from rdf_index import open_rdf_index
+from sparql import get_client
+
+
+DEFAULT_DUMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wikidata")
+
+WD_PREFIXES = ("http://www.wikidata.org/entity/", "http://www.wikidata.org/prop/direct/")
+
+OUT_EDGES_QUERY = """PREFIX wd: <http://www.wikidata.org/entity/>
+
+SELECT ?h ?p ?t
+WHERE
+{{
+  VALUES ?h {{ {heads} }}
+  ?h ?p ?t .
+  FILTER (STRSTARTS(STR(?p), "http://www.wikidata.org/prop/direct/P"))
+  FILTER (STRSTARTS(STR(?t), "http://www.wikidata.org/entity/Q"))
+}}
+"""
+
+EDGES_BETWEEN_QUERY = """PREFIX wd: <http://www.wikidata.org/entity/>
+
+SELECT ?h ?p ?t
+WHERE
+{{
+  VALUES ?h {{ {heads} }}
+  VALUES ?t {{ {tails} }}
+  ?h ?p ?t .
+  FILTER (STRSTARTS(STR(?p), "http://www.wikidata.org/prop/direct/P"))
+}}
+"""
+
+# tails per query of the edges between two sets, the heads are batched by the caller
+TAILS_PER_QUERY = 500
+
+ENTITY_INFO_QUERY = """PREFIX schema: <http://schema.org/>
+PREFIX wd: <http://www.wikidata.org/entity/>
+PREFIX owl: <http://www.w3.org/2002/07/owl#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+
+SELECT ?e ?label ?description ?redirection ?redirected_label ?redirected_description WHERE {{
+  VALUES ?e {{ {entities} }}
+  OPTIONAL {{ ?e rdfs:label ?label. FILTER (langMatches( lang(?label), "EN" )). }}
+  OPTIONAL {{ ?e schema:description ?description. FILTER (langMatches( lang(?description), "EN" )). }}
+  OPTIONAL {{
+    ?e owl:sameAs ?redirection.
+    OPTIONAL {{ ?redirection rdfs:label ?redirected_label. FILTER (langMatches( lang(?redirected_label), "EN" )). }}
+    OPTIONAL {{ ?redirection schema:description ?redirected_description. FILTER (langMatches( lang(?redirected_description), "EN" )). }}
+  }}
+}}"""
+
+FIELDS = ("label", "description", "redirection", "redirected_label", "redirected_description")
+
+
+def strip_prefix(uri: str) -> str:
+    for prefix in WD_PREFIXES:
+        if uri.startswith(prefix):
+            return uri[len(prefix):]
+    return uri
+
+
+def out_edges_query(heads: list[str]) -> str:
+    return OUT_EDGES_QUERY.format(heads=" ".join(f"wd:{h}" for h in heads))
+
+
+def parse_out_edges(response: dict) -> list[tuple]:
+    return [
+        (strip_prefix(b["h"]["value"]), strip_prefix(b["p"]["value"]), strip_prefix(b["t"]["value"]))
+        for b in response["results"]["bindings"]
+    ]
+
+
+def query_for_out_edges(heads: list[str]) -> list[tuple]:
+    return parse_out_edges(get_client().query(out_edges_query(heads)))
+
+
+def query_for_out_edges_by_head(heads: list[str]) -> list[list[tuple]]:
+    edges = {h: [] for h in heads}
+    for h, r, t in query_for_out_edges(heads):
+        edges[h].append((r, t))
+    return [edges[h] for h in heads]
+
+
+def edges_between_query(heads: list[str], tails: list[str]) -> str:
+    return EDGES_BETWEEN_QUERY.format(heads=" ".join(f"wd:{h}" for h in heads), tails=" ".join(f"wd:{t}" for t in tails))
+
+
+def query_for_edges_between(heads: list[str], tails: list[str]) -> list[list[tuple]]:
+    # bounded by both sets, unlike the incoming edges of a tail that can be millions (e.g. Q5)
+    edges = {h: [] for h in heads}
+    for i in range(0, len(tails), TAILS_PER_QUERY):
+        response = get_client().query(edges_between_query(heads, tails[i:i + TAILS_PER_QUERY]))
+        for h, r, t in parse_out_edges(response):
+            edges[h].append((r, t))
+    return [edges[h] for h in heads]
+
+
+def _resolve_redirection(info: dict) -> dict:
+    # labels missing and descriptions missing or meaningless are taken from the redirection target
+    label = info["label"] if info["label"] is not None else info["redirected_label"]
+    description = info["description"]
+    if description is None or "Wikimedia" in description:
+        description = info["redirected_description"]
+    redirection = info["redirection"]
+    if redirection is not None:
+        redirection = redirection.replace("http://www.wikidata.org/entity/", "")
+    return {"label": label, "description": description, "redirection": redirection}
+
+
+def entity_info_query(entities: list[str]) -> list[dict]:
+    # label, description and redirection of every entity in a single query
+    query = ENTITY_INFO_QUERY.format(entities=" ".join(f"wd:{e}" for e in entities))
+    data = {e: dict.fromkeys(FIELDS) for e in entities}
+    for b in get_client().query(query)["results"]["bindings"]:
+        info = data.get(b["e"]["value"].replace("http://www.wikidata.org/entity/", ""))
+        if info is None:
+            continue
+        for field in FIELDS:
+            if field in b and info[field] is None:
+                info[field] = b[field]["value"]
+    return [_resolve_redirection(data[e]) for e in entities]
+
+
+def query_wikipedia_link(var, entity):
+    return f"""
+    OPTIONAL {{
+        {var} schema:about wd:{entity} .
+        {var} schema:inLanguage "en" .
+        FILTER (SUBSTR(str({var}), 1, 25) = "https://en.wikipedia.org/")
+    }}
+    """
+
+
+def get_wikipedia_links_query(entities):
+    variables = [f"?link{i}" for i in range(len(entities))]
+    expr = "".join([query_wikipedia_link(var, ent) for var, ent in zip(variables, entities)])
+    return f"""
+    prefix schema: <http://schema.org/>
+    PREFIX wikibase: <http://wikiba.se/ontology#>
+    PREFIX wd: <http://www.wikidata.org/entity/>
+    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+
+    SELECT {" ".join(variables)} WHERE {{
+        {expr}
+    }}
+    """
+
+
+def get_wikipedia_link(entities):
+    r = get_client().query(get_wikipedia_links_query(entities))
+    var = r["head"]["vars"]
+    links = []
+    for v in var:
+        if v in r["results"]["bindings"][0]:
+            links.append(r["results"]["bindings"][0][v]["value"])
+        else:
+            links.append(None)
+    return links
+
+
+class Backend(ABC):
+    # every lookup takes a batch of entities and returns one value per entity, in order; a backend
+    # missing one of the abstract lookups fails when it is created rather than in the middle of a run
+
+    @abstractmethod
+    def out_edges(self, heads: list[str]) -> list[list[tuple]]:
+        # (relation, tail) pairs of the outgoing edges of every head
+        ...
+
+    @abstractmethod
+    def edges_between(self, heads: list[str], tails: list[str]) -> list[list[tuple]]:
+        # (relation, tail) pairs of the outgoing edges of every head that end in one of the tails
+        ...
+
+    @abstractmethod
+    def entity_info(self, entities: list[str]) -> list[dict]:
+        # label, description and redirection of every entity, see _resolve_redirection
+        ...
+
+    @abstractmethod
+    def wikipedia_links(self, entities: list[str]) -> list[str]:
+        # url of the english wikipedia page of every entity, None if it has none
+        ...
+
+    def labels(self, entities: list[str]) -> list[str]:
+        return [info["label"] for info in self.entity_info(entities)]
+
+    def descriptions(self, entities: list[str]) -> list[str]:
+        return [info["description"] for info in self.entity_info(entities)]
+
+    def redirections(self, entities: list[str]) -> list[str]:
+        return [info["redirection"] for info in self.entity_info(entities)]
+
+    @abstractmethod
+    def map(self, fn, items: list, batcher):
+        # (batch, results) of fn over the items, in order
+        ...
+
+    def close(self):
+        pass
+
+
+class SPARQLBackend(Backend):
+    # the live endpoint, every response goes through the persistent cache
+
+    def out_edges(self, heads: list[str]) -> list[list[tuple]]:
+        return cached("out_edges", query_for_out_edges_by_head)(heads)
+
+    def edges_between(self, heads: list[str], tails: list[str]) -> list[list[tuple]]:
+        # the complete outgoing edges cached by a previous run are filtered locally, the other heads are
+        # queried for the tails only, which is not cached since it depends on the tails
+        known = get_cache().get_many("out_edges", heads)
+        missing = [h for h in dict.fromkeys(heads) if h not in known]
+        edges = dict(zip(missing, query_for_edges_between(missing, list(tails)))) if len(missing) > 0 else {}
+        tails = set(tails)
+        edges.update({h: [(r, t) for r, t in out_edges if t in tails] for h, out_edges in known.items()})
+        return [edges[h] for h in heads]
+
+    def entity_info(self, entities: list[str]) -> list[dict]:
+        return cached("entity_info", entity_info_query)(entities)
+
+    def wikipedia_links(self, entities: list[str]) -> list[str]:
+        return cached("wikipedia_link", get_wikipedia_link)(entities)
+
+    def map(self, fn, items: list, batcher):
+        yield from batcher.map(fn, items)
+
+
+class LocalBackend(Backend):
+    # the outputs of wikidata/extract_from_dump.py: the triplets are indexed by rdf_index.py and the
+    # names, descriptions, redirections and sitelinks by entity_store.py, both built on first use
+
+    def __init__(self, dump_dir: str=DEFAULT_DUMP_DIR, triplets: str=None, batchsize: int=1000):
+        self.dump_dir = dump_dir
+        self.triplets = f"{dump_dir}/rdf_triplets.txt" if triplets is None else triplets
+        self.batchsize = batchsize
+        self._index = None
+        self._store = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = open_rdf_index(self.triplets)
+        return self._index
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = open_entity_store(self.dump_dir)
+        return self._store
+
+    def out_edges(self, heads: list[str]) -> list[list[tuple]]:
+        edges = {h: [] for h in heads}
+        for h, r, t in self.index.out_edges(heads):
+            edges[h].append((r, t))
+        return [edges[h] for h in heads]
+
+    def edges_between(self, heads: list[str], tails: list[str]) -> list[list[tuple]]:
+        tails = set(tails)
+        return [[(r, t) for r, t in out_edges if t in tails] for out_edges in self.out_edges(heads)]
+
+    def entity_info(self, entities: list[str]) -> list[dict]:
+        # same resolution as the remote query, with the redirection targets looked up in a second pass
+        redirections = self.store.get_many("redirections", entities)
+        keys = list(entities) + list(redirections.values())
+        names = self.store.get_many("names", keys)
+        descriptions = self.store.get_many("descriptions", keys)
+        infos = []
+        for e in entities:
+            redirection = redirections.get(e)
+            infos.append(_resolve_redirection({
+                "label": names.get(e),
+                "description": descriptions.get(e),
+                "redirection": redirection,
+                "redirected_label": names.get(redirection),
+                "redirected_description": descriptions.get(redirection)
+            }))
+        return infos
+
+    def wikipedia_links(self, entities: list[str]) -> list[str]:
+        sitelinks = self.store.get_many("sitelinks", entities)
+        return [sitelinks.get(e) for e in entities]
+
+    def map(self, fn, items: list, batcher):
+        # local lookups are cheap, fixed size batches in the calling thread
+        items = list(items)
+        for i in range(0, len(items), self.batchsize):
+            batch = items[i:i + self.batchsize]
+            yield batch, list(fn(batch))
+
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+
+BACKENDS = {"sparql": SPARQLBackend, "local": LocalBackend}
+
+_backend = None
+
+
+def configure_backend(name: str="sparql", **kwargs) -> Backend:
+    global _backend
+    if name not in BACKENDS:
+        raise RuntimeError(f"Unknown backend: {name}, use one of {tuple(BACKENDS)}.")
+    if _backend is not None:
+        _backend.close()
+    _backend = BACKENDS[name](**kwargs)
+    return _backend
+
+
+def get_backend() -> Backend:
+    global _backend
+    if _backend is None:
+        _backend = SPARQLBackend()
+    return _backend
+
+
+def add_backend_arguments(parser):
+    parser.add_argument("--backend", choices=tuple(BACKENDS), default="sparql", help="live Wikidata endpoint, or the local outputs of wikidata/extract_from_dump.py")
+    parser.add_argument("--dump-dir", default=DEFAULT_DUMP_DIR, help="local backend: directory with rdf_triplets.txt, names.txt, descriptions.txt, redirections.txt and sitelinks.txt")
+    parser.add_argument("--dump-triplets", help="local backend: triplets file to use instead of <dump-dir>/rdf_triplets.txt")
+
+
+def backend_from_args(args) -> Backend:
+    if args.backend == "local":
+        return configure_backend("local", dump_dir=args.dump_dir, triplets=args.dump_triplets)
+    return configure_backend("sparql")
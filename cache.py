@@ -0,0 +1,127 @@
+import json, os, sqlite3, threading, time
+
+from functools import wraps
+
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "wikidata-graph-builder", "cache.sqlite")
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS entries (
+  kind TEXT NOT NULL,
+  key TEXT NOT NULL,
+  value TEXT,
+  ts REAL NOT NULL,
+  PRIMARY KEY (kind, key)
+) WITHOUT ROWID"""
+
+
+class Cache:
+
+    def __init__(self, path: str=DEFAULT_CACHE, ttl: float=None, max_entries: int=None):
+        # path=":memory:" gives a cache that only lives as long as the process
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute(SCHEMA)
+        self.db.execute("CREATE INDEX IF NOT EXISTS ts_idx ON entries (ts)")
+        self.db.commit()
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            if self.ttl is not None:
+                self.db.execute("DELETE FROM entries WHERE ts < ?", (time.time() - self.ttl,))
+            if self.max_entries is not None and self.max_entries > 0:
+                # keep the `max_entries` most recent entries
+                self.db.execute(
+                    "DELETE FROM entries WHERE ts < (SELECT ts FROM entries ORDER BY ts DESC LIMIT 1 OFFSET ?)",
+                    (self.max_entries - 1,)
+                )
+            self.db.commit()
+
+    def get_many(self, kind: str, keys: list[str], batchsize: int=500) -> dict:
+        hits = {}
+        oldest = time.time() - self.ttl if self.ttl is not None else 0.
+        keys = list(keys)
+        with self.lock:
+            for i in range(0, len(keys), batchsize):
+                batch = keys[i:i + batchsize]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = self.db.execute(
+                    f"SELECT key, value FROM entries WHERE kind = ? AND ts >= ? AND key IN ({placeholders})",
+                    [kind, oldest] + batch
+                )
+                for key, value in rows:
+                    hits[key] = json.loads(value)
+        return hits
+
+    def put_many(self, kind: str, items: dict):
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                [(kind, key, json.dumps(value), now) for key, value in items.items()]
+            )
+            self.db.commit()
+
+    def close(self):
+        if self.db is None:
+            return
+        self.evict()
+        self.db.close()
+        self.db = None
+
+
+_cache = None
+
+
+def configure_cache(path: str=DEFAULT_CACHE, ttl: float=None, max_entries: int=None) -> Cache:
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = Cache(path, ttl, max_entries)
+    return _cache
+
+
+def get_cache() -> Cache:
+    global _cache
+    if _cache is None:
+        _cache = Cache()
+    return _cache
+
+
+def add_cache_arguments(parser):
+    parser.add_argument("--cache", default=DEFAULT_CACHE, help="persistent cache of the Wikidata/Wikipedia responses")
+    parser.add_argument("--cache-ttl", type=float, help="expire cached responses older than this many days")
+    parser.add_argument("--cache-max-entries", type=int, help="keep at most this many cached responses, evicting the oldest")
+    parser.add_argument("--no-cache", action="store_true")
+
+
+def configure_cache_from_args(args) -> Cache:
+    return configure_cache(
+        ":memory:" if args.no_cache else args.cache,
+        ttl=args.cache_ttl * 86400 if args.cache_ttl is not None else None,
+        max_entries=args.cache_max_entries
+    )
+
+
+def cached(kind: str, fn):
+    # wrap a batch function returning one value per key: cached keys are served locally and only
+    # the missing ones are passed on to fn, which is not called at all if every key is cached
+    @wraps(fn)
+    def wrapper(keys: list[str], *args, **kwargs):
+        cache = get_cache()
+        hits = cache.get_many(kind, keys)
+        missing = [k for k in dict.fromkeys(keys) if k not in hits]
+        if len(missing) > 0:
+            values = fn(missing, *args, **kwargs)
+            # normalise through json, so that fresh and cached values look the same
+            fresh = {k: json.loads(json.dumps(v)) for k, v in zip(missing, values)}
+            cache.put_many(kind, fresh)
+            hits.update(fresh)
+        return tuple(hits[k] for k in keys)
+    return wrapper
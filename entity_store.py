@@ -0,0 +1,82 @@
+import os, sqlite3, time
+
+from files import atomic_path, build_lock, is_stale
+
+
+# one `id value` table per file extracted from the dump (see wikidata/extract_from_dump.py)
+TABLES = ("names", "descriptions", "redirections", "sitelinks")
+
+
+def build_entity_store(dump_dir: str, store_path: str, batchsize: int=1000000):
+    with atomic_path(store_path) as tmp_path:
+        db = sqlite3.connect(tmp_path)
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        start = time.time()
+        for table in TABLES:
+            db.execute(f"CREATE TABLE {table} (id TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID")
+            path = f"{dump_dir}/{table}.txt"
+            if not os.path.exists(path):
+                print(f"> {path} not found, {table} will be empty")
+                continue
+            n_rows = 0
+            batch = []
+            with open(path, "r") as f:
+                for line in f:
+                    line = line.rstrip("\n").split(" ", 1)
+                    if len(line) != 2:
+                        continue
+                    batch.append(line)
+                    if len(batch) == batchsize:
+                        # only the first value of every id is kept, as the live endpoint would return it
+                        db.executemany(f"INSERT OR IGNORE INTO {table} VALUES (?, ?)", batch)
+                        n_rows += len(batch)
+                        batch = []
+                        print(f"> Storing {table}. ({n_rows})", end="\r")
+            db.executemany(f"INSERT OR IGNORE INTO {table} VALUES (?, ?)", batch)
+            n_rows += len(batch)
+            print(f"> Storing {table}. ({n_rows})")
+        db.commit()
+        db.close()
+    print(f"> Stored the entities of {dump_dir} in {time.time() - start:.1f}s: {store_path}")
+
+
+class EntityStore:
+
+    def __init__(self, store_path: str):
+        if not os.path.exists(store_path):
+            raise FileNotFoundError(store_path)
+        self.db = sqlite3.connect(f"file:{store_path}?mode=ro", uri=True, check_same_thread=False)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_many(self, table: str, keys: list[str], batchsize: int=500) -> dict:
+        if table not in TABLES:
+            raise RuntimeError(f"Unknown table: {table}, use one of {TABLES}.")
+        values = {}
+        keys = [k for k in dict.fromkeys(keys) if k is not None]
+        for i in range(0, len(keys), batchsize):
+            batch = keys[i:i + batchsize]
+            placeholders = ", ".join("?" for _ in batch)
+            values.update(self.db.execute(f"SELECT id, value FROM {table} WHERE id IN ({placeholders})", batch))
+        return values
+
+
+def open_entity_store(dump_dir: str, store_path: str=None) -> EntityStore:
+    if store_path is None:
+        store_path = f"{dump_dir}/entities.sqlite"
+    # rebuilt when one of the files was extracted again since, the store would serve the old values
+    sources = [f"{dump_dir}/{table}.txt" for table in TABLES]
+    if is_stale(store_path, *sources):
+        with build_lock(store_path):
+            # another process may have built it while this one was waiting
+            if is_stale(store_path, *sources):
+                build_entity_store(dump_dir, store_path)
+    return EntityStore(store_path)
@@ -0,0 +1,56 @@
+import fcntl, os, shutil
+
+from contextlib import contextmanager
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+@contextmanager
+def atomic_path(path: str):
+    # a temporary path (file or directory) that replaces `path` once the block completes, so that an
+    # interrupted write never leaves a truncated or half-built file behind; named after the process so
+    # that concurrent writers (e.g. the tasks of an array job) do not clash
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    _remove(tmp_path)
+    try:
+        yield tmp_path
+    except BaseException:
+        _remove(tmp_path)
+        raise
+    if os.path.isdir(tmp_path) and os.path.isdir(path):
+        # os.replace does not overwrite a non-empty directory
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def atomic_write(path: str, mode: str="w", **kwargs):
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+
+
+@contextmanager
+def build_lock(path: str):
+    # exclusive lock on <path>.lock while `path` is built, so that the processes opening it at the same time
+    # (e.g. the tasks of an array job) wait for the first one instead of all building it; on a shared file
+    # system the mount has to support flock
+    with open(f"{path}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def is_stale(target: str, *sources: str) -> bool:
+    # missing, or older than one of the (existing) files it is built from
+    if not os.path.exists(target):
+        return True
+    mtime = os.path.getmtime(target)
+    return any(os.path.exists(source) and os.path.getmtime(source) > mtime for source in sources)
@@ -1,115 +1,78 @@
-import json, os, requests, sys, time
+import argparse, json, os
 
-from bs4 import BeautifulSoup
 from tqdm import tqdm
 
-from langchain_community.llms import Ollama
-from langchain.prompts import PromptTemplate
-from multiprocessing import Pool
-
+from backends import add_backend_arguments, backend_from_args, get_backend
+from cache import add_cache_arguments, configure_cache_from_args
+from files import atomic_write
+from llm import OllamaGenerator, add_llm_arguments, generator_from_args
 from to_graph import load_entities
+from sparql import add_client_arguments, batcher_from_args, configure_from_args
+from wikipedia import WikipediaFetcher, add_wikipedia_arguments, fetcher_from_args
 
-SPARQL_ENDPOINT = "https://query.wikidata.org/bigdata/namespace/wdq/sparql" 
-
-def query_wikipedia_link(var, entity):
-    return f"""
-    OPTIONAL {{
-        {var} schema:about wd:{entity} .
-        {var} schema:inLanguage "en" .
-        FILTER (SUBSTR(str({var}), 1, 25) = "https://en.wikipedia.org/")
-    }}
-    """
-
-
-def get_wikipedia_links_query(entities):
-    variables = [f"?link{i}" for i in range(len(entities))]
-    expr = "".join([query_wikipedia_link(var, ent) for var, ent in zip(variables, entities)])
-    return f"""
-    prefix schema: <http://schema.org/>
-    PREFIX wikibase: <http://wikiba.se/ontology#>
-    PREFIX wd: <http://www.wikidata.org/entity/>
-    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-    
-    SELECT {" ".join(variables)} WHERE {{
-        {expr}
-    }} 
-    """
-
-
-def get_wikipedia_link(entities):
-    status = None
-    while status != 200:
-        r = requests.get(
-            SPARQL_ENDPOINT,
-            params = {'format': 'json', 'query': get_wikipedia_links_query(entities)}
-        )
-        status = r.status_code
-        if status != 200:
-            print(f"-> received {status} response.")
-            time.sleep(0.3)
-        
-        
-    r = r.json()
-    var = r["head"]["vars"]
-    links = []
-    for v in var:
-        if v in r["results"]["bindings"][0]:
-            links.append(r["results"]["bindings"][0][v]["value"])
-        else:
-            links.append(None)
-    return links
 
+def extract_wikipedia_paragraph(entities, links=None, fetcher: WikipediaFetcher=None):
+    # lead section of the wikipedia page of every entity, None for the entities without a page
+    if links is None:
+        links = get_backend().wikipedia_links(entities)
+    fetcher = WikipediaFetcher() if fetcher is None else fetcher
+    return fetcher.fetch(links)
 
-def wikipedia_paragraph_extractor(link):
-    par = None
-    if link is not None:
-        status = None
-        while status != 200:
-            r = requests.get(link)
-            status = r.status_code
-            if status != 200:
-                print(f"-> received {status} response.")
-                time.sleep(1)
-        soup = BeautifulSoup(r.content, "html.parser")
-        ps = soup.find_all("p")
-        par = "".join(map(lambda x: x.get_text(), ps[:5]))
-    return par
 
+PROMPT = "A Wikidata entity is provided below. Generate a short one-sentence long description of the entity.\nEntity: {entity}"
 
-def extract_wikipedia_paragraph(entities):
-    links = get_wikipedia_link(entities)
-    with Pool(6) as p:
-        paragraphs = p.map(wikipedia_paragraph_extractor, links)
-    return paragraphs
-    
 
+def is_missing(description: str) -> bool:
+    return description is None or description == "None" or "Wikimedia" in description
 
-PROMPT = PromptTemplate.from_template("A Wikidata entity is provided below. Generate a short one-sentence long description of the entity.\nEntity: {entity}")
 
-def generate_missing_description(entity: str, llm):
-    breakpoint()
-    return llm.invoke(PROMPT.format(entity=entity))
+def generate_missing_descriptions(entities: list[str], infos: list[dict], generator: OllamaGenerator) -> dict:
+    # a description for every entity with a label but without a meaningful description
+    selected = [(e, info["label"]) for e, info in zip(entities, infos) if is_missing(info["description"]) and info["label"] is not None]
+    print(f"> Generating {len(selected)} missing descriptions with {generator.model}")
+    prompts = [(e, PROMPT.format(entity=label)) for e, label in selected]
+    generations = tqdm(generator.imap(prompts), total=len(prompts), desc="descriptions")
+    return {e: g for (e, _), g in zip(selected, generations) if g is not None}
 
 
+def dump_json(data: dict, path: str):
+    with atomic_write(path) as f:
+        json.dump(data, f, indent=2)
 
 
 if __name__ == "__main__":
-
-    entities = list(set(load_entities(sys.argv[1])))
-    working_dir = os.path.dirname(sys.argv[1])
-    batchsize = 20
-    paragraphs = []
-    for i in tqdm(range(0, len(entities), batchsize), total=int(len(entities)/batchsize)):  
-        for par in extract_wikipedia_paragraph(entities[i:i + batchsize]):
-            #print(f"\n-------------------------------------------------\n{par}\n----------------------------------------------\n")
-            paragraphs.append(par)
-    ent2wikipeda = dict(zip(entities, paragraphs))
-    with open(f"{working_dir}/wikipedia_pages.json", "w") as f:
-        json.dump(ent2wikipeda, f, indent=2)
-    
-    llm = Ollama(model="llama2:13b")
-    entity_labels = [id_to_label[i] for i in entity_ids]
-    for i, d in enumerate(descriptions):
-        if d is None or d == "None" or "Wikimedia" in d:
-            print(entity_ids[i])
-            descriptions[i] = generate_missing_description(entity_labels[i], llm)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("entities")
+    add_backend_arguments(parser)
+    add_client_arguments(parser)
+    add_wikipedia_arguments(parser)
+    add_llm_arguments(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    configure_cache_from_args(args)
+    backend = backend_from_args(args)
+    fetcher = fetcher_from_args(args)
+    generator = generator_from_args(args)
+
+    entities = list(set(load_entities(args.entities)))
+    working_dir = os.path.dirname(args.entities)
+    links = []
+    batcher = batcher_from_args(args, initial=20)
+    for batch, batch_links in tqdm(backend.map(backend.wikipedia_links, entities, batcher), desc="links"):
+        links += batch_links
+    batcher.report()
+    # all the pages in one stream, so that the connection pool stays busy across the batches
+    paragraphs = list(tqdm(fetcher.imap(links), total=len(links), desc="pages"))
+    fetcher.report()
+    fetcher.close()
+    dump_json(dict(zip(entities, paragraphs)), f"{working_dir}/wikipedia_pages.json")
+
+    infos = []
+    for batch, batch_infos in backend.map(backend.entity_info, entities, batcher):
+        infos += batch_infos
+    generated = generate_missing_descriptions(entities, infos, generator)
+    generator.report()
+    generator.close()
+    dump_json(generated, f"{working_dir}/generated_descriptions.json")
+    print(f"> {len(generated)} generated descriptions: {working_dir}/generated_descriptions.json")
@@ -1,23 +1,18 @@
-import argparse, requests, time, os, sys
+import argparse, json, os, sys
 
+from backends import Backend, add_backend_arguments, backend_from_args, get_backend
+from cache import add_cache_arguments, configure_cache_from_args
+from files import atomic_write
 from to_graph import load_entities
+from sparql import AdaptiveBatcher, add_client_arguments, batcher_from_args, configure_from_args
 sys.path.append("./wikidata-disamb")
 from prepare import load
 
 
-SPARQL_ENDPOINT = "https://query.wikidata.org/bigdata/namespace/wdq/sparql" 
-QUERY = """PREFIX schema: <http://schema.org/> 
-PREFIX wd: <http://www.wikidata.org/entity/> 
-
-SELECT {_vars} WHERE {{
-{expr}
-}}"""
-
-
 def dump(filename: str, ids: list[str], data: list[str] = None):
     if data is not None and len(ids) != len(data):
         raise RuntimeError(f"ids and data have different lenghts: {len(ids)} and {len(data)}")
-    with open(filename, "w") as f:
+    with atomic_write(filename) as f:
         items = zip(ids, data) if data is not None else ids
         for i, item in enumerate(items):
             if data is not None:
@@ -29,184 +24,147 @@ def dump(filename: str, ids: list[str], data: list[str] = None):
 
 
 def redirections_query(entities: list[str]):
-    _vars = [f"?r{i}" for i in range(len(entities))]
-    expr = "\n".join([
-        f"OPTIONAL {{ wd:{e} owl:sameAs {_vars[i]}. }}"
-        for i, e in enumerate(entities)
-    ])       
-    query = QUERY.format(_vars=" ".join(_vars), expr=expr)
-    status = None
-    while status != 200:
-        r = requests.get(
-            SPARQL_ENDPOINT,
-            params = {'format': 'json', 'query': query}
-        )
-        status = r.status_code
-        if status == 429:
-            print("> 429: too many requests.")
-            time.sleep(3)
-        elif status == 200:
-            bindings = r.json()["results"]["bindings"]
-            data = {f"r{i}": None for i in range(len(entities))}
-            for b in bindings:
-                for d, val in b.items():
-                    if data[d] is None:
-                        data[d] = val["value"]
-            _, redirections = zip(*sorted(list(data.items()), key=lambda x: int(x[0].replace("r", ""))))
-            redirections = list(redirections)
-            for i in range(len(redirections)):
-                if redirections[i] is not None:
-                    redirections[i] = redirections[i].replace("http://www.wikidata.org/entity/", "")
-            redirections = tuple(redirections)
-            time.sleep(0.5)
-        else:
-            print(f"> {status}: error.")
-            raise RuntimeError
-    return redirections
+    return tuple(get_backend().redirections(entities))
 
                 
-def descriptions_query(entities: list[str], check_for_redirections: bool=True) -> list[str]:
-    _vars = [f"?d{i}" for i in range(len(entities))]
-    expr = "\n".join([
-        f"OPTIONAL {{ wd:{e} schema:description {_vars[i]}.\nFILTER (langMatches( lang({_vars[i]}), \"EN\" )). }}"
-        for i, e in enumerate(entities)
-    ])
-    query = QUERY.format(_vars=" ".join(_vars), expr=expr)
-    status = None
-    while status != 200:
-        r = requests.get(
-            SPARQL_ENDPOINT,
-            params = {'format': 'json', 'query': query}
-        )
-        status = r.status_code
-        if status == 429:
-            print("> 429: too many requests.")
-            time.sleep(3)
-        elif status == 200:
-            bindings = r.json()["results"]["bindings"]
-            data = {f"d{i}": None for i in range(len(entities))}
-            for b in bindings:
-                for d, val in b.items():
-                    if data[d] is None:
-                        data[d] = val["value"]
-            _, descriptions = zip(*sorted(list(data.items()), key=lambda x: int(x[0].replace("d", ""))))
-            time.sleep(0.5)
-        else:
-            print(f"> {status}: error.")
-            raise RuntimeError
-    none_idx = [i for i,d in enumerate(descriptions) if d is None or "Wikimedia" in d]
-    if check_for_redirections and len(none_idx) > 0:
-        breakpoint()
-        redirected_ents = redirections_query([entities[i] for i in none_idx])
-        redirected_desc = descriptions_query(redirected_ents, check_for_redirections=False)
-        descriptions = list(descriptions)
-        for i, desc in zip(none_idx, redirected_desc):
-            descriptions[i] = desc
-        descriptions = tuple(descriptions)
-    return descriptions
-
-
-def labels_query(entities: list[str], check_for_redirections: bool=True) -> list[str]:
-    _vars = [f"?l{i}" for i in range(len(entities))]
-    expr = "\n".join([
-        f"OPTIONAL {{ wd:{e} rdfs:label {_vars[i]}.\nFILTER (langMatches( lang({_vars[i]}), \"EN\" )). }}"
-        for i, e in enumerate(entities)
-    ])
-    query = QUERY.format(_vars=" ".join(_vars), expr=expr)
-    status = None
-    while status != 200:
-        r = requests.get(
-            SPARQL_ENDPOINT,
-            params = {'format': 'json', 'query': query}
-        )
-        status = r.status_code
-        if status == 429:
-            print("> 429: too many requests.")
-            time.sleep(3)
-        elif status == 200:
-            bindings = r.json()["results"]["bindings"]
-            data = {f"l{i}": None for i in range(len(entities))}
-            for b in bindings:
-                for l, val in b.items():
-                    if data[l] is None:
-                        data[l] = val["value"]
-            _, labels = zip(*sorted(list(data.items()), key=lambda x: int(x[0].replace("l", ""))))
-            time.sleep(1)
-        else:
-            print(f"> {status}: error.")
-            raise RuntimeError
-    none_idx = [i for i,l in enumerate(labels) if l is None]
-    if check_for_redirections and len(none_idx) > 0:
-        redirected_ents = redirections_query([entities[i] for i in none_idx])
-        redirected_labels = labels_query(redirected_ents, check_for_redirections=False)
-        labels = list(labels)
-        for i, lab in zip(none_idx, redirected_labels):
-            labels[i] = lab
-        labels = tuple(labels)
-    return labels
+def descriptions_query(entities: list[str]) -> list[str]:
+    return tuple(get_backend().descriptions(entities))
 
 
-def get_redirections(entities: set[str] | list[str], batchsize: int=20) -> list[str]:
-    print("> Looking for redirected entities")
-    global entities_dir, redirections_bkup
-    missing_ents = [e for e in entities if e not in redirections_bkup]
-
-    redirections = list(redirections_bkup.values())
-    ent_ids = list(redirections_bkup.keys())
-    for i in range(0, len(missing_ents), batchsize):
-        ents = missing_ents[i:i + batchsize]
-        redirections += redirections_query(ents)
-        ent_ids += ents
-        ent_labels = missing_ents[:i + batchsize]
-        print(f"({i + len(redirections_bkup)}/{len(entities)})", end="\r")
-        if i % (10 * batchsize) == 0:
-            dump(f"{entities_dir}/../redirections.txt", list(redirections_bkup.keys()) + missing_ents[:i + batchsize], redirections)
+def labels_query(entities: list[str]) -> list[str]:
+    return tuple(get_backend().labels(entities))
+
+
+class Journal:
+    # append-only checkpoint: one json `[id, value]` line per entity, fsync'd after every batch,
+    # so that a checkpoint costs O(batch) and a crash loses at most the batch being written
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.f = None
+
+    def load(self) -> dict:
+        records = {}
+        valid = 0
+        try:
+            with open(self.filename, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        _id, value = json.loads(line)
+                    except ValueError:
+                        break
+                    records[_id] = value
+                    valid += len(line)
+        except FileNotFoundError:
+            return records
+        # drop a torn last line left by a crash, so that new records are appended after the last valid one
+        with open(self.filename, "ab") as f:
+            f.truncate(valid)
+        return records
+
+    def append(self, ids: list[str], values: list[str]):
+        if self.f is None:
+            self.f = open(self.filename, "a")
+        self.f.write("".join(json.dumps([_id, value]) + "\n" for _id, value in zip(ids, values)))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def collect(entities: list[str], backup: dict, query_fn, journal_file: str, finalize, batcher: AdaptiveBatcher, backend: Backend=None) -> tuple[list[str], list]:
+    # resume from the backup and from the journal of an interrupted run, query only the remaining entities
+    journal = Journal(journal_file)
+    backend = get_backend() if backend is None else backend
+    recorded = {**backup, **journal.load()}
+    missing_ents = [e for e in dict.fromkeys(entities) if e not in recorded]
+    if len(recorded) > len(backup):
+        print(f"> Resuming: {len(recorded) - len(backup)} entities recovered from {journal.filename}")
+
+    done, total = len(recorded), len(recorded) + len(missing_ents)
+    for ents, values in backend.map(query_fn, missing_ents, batcher):
+        journal.append(ents, values)
+        recorded.update(zip(ents, values))
+        done += len(ents)
+        print(f"({done}/{total})", end="\r")
     print("\n")
-    return ent_ids, redirections
+    batcher.report()
+    ent_ids, values = list(recorded.keys()), list(recorded.values())
+    # the journal is only dropped once the outputs are safely written
+    finalize(ent_ids, values)
+    journal.remove()
+    return ent_ids, values
+
+
+def _dump_entity_info(ent_ids: list[str], infos: list[dict]):
+    global entities_dir, redirections_bkup, labels_bkup, descriptions_bkup
+    outputs = (
+        ("redirection", redirections_bkup, f"{entities_dir}/../redirections.txt"),
+        ("label", labels_bkup, f"{entities_dir}/labels.txt"),
+        ("description", descriptions_bkup, f"{entities_dir}/descriptions.txt"),
+    )
+    for field, bkup, outfile in outputs:
+        # backed up entities outside of the current set are kept
+        data = {**bkup, **{e: info[field] for e, info in zip(ent_ids, infos)}}
+        dump(outfile, list(data.keys()), list(data.values()))
+
+
+def get_entity_info(entities: set[str] | list[str], batchsize: int=20, batcher: AdaptiveBatcher=None, backend: Backend=None) -> tuple[list[str], list[dict]]:
+    print("> Collecting entity redirections, labels and descriptions")
+    global entities_dir, redirections_bkup, labels_bkup, descriptions_bkup
+    # only the entities found in all the backups can be skipped
+    backup = {
+        e: {"label": labels_bkup[e], "description": descriptions_bkup[e], "redirection": redirections_bkup[e]}
+        for e in entities
+        if e in labels_bkup and e in descriptions_bkup and e in redirections_bkup
+    }
+    backend = get_backend() if backend is None else backend
+    return collect(
+        entities,
+        backup,
+        backend.entity_info,
+        f"{entities_dir}/entity_info.journal",
+        _dump_entity_info,
+        AdaptiveBatcher(initial=batchsize) if batcher is None else batcher,
+        backend
+    )
+
+
+def get_redirections(entities: set[str] | list[str], batchsize: int=20) -> list[str]:
+    ent_ids, infos = get_entity_info(entities, batchsize)
+    return ent_ids, [info["redirection"] for info in infos]
 
 
 def get_descriptions(entities: set[str] | list[str], batchsize: int=20) -> list[str]:
-    print("> Collecting entity descriptions")
-    global entities_dir, descriptions_bkup
-    missing_ents = [e for e in entities if e not in descriptions_bkup]
-    
-    descriptions = list(descriptions_bkup.values())
-    ent_ids = list(descriptions_bkup.keys())
-    for i in range(0, len(missing_ents), batchsize):
-        ents = missing_ents[i:i + batchsize]
-        descriptions += descriptions_query(ents)
-        ent_ids += ents
-        ent_labels = missing_ents[:i + batchsize]
-        print(f"({i + len(descriptions_bkup)}/{len(entities)})", end="\r")
-        if i % (10 * batchsize) == 0:
-            dump(f"{entities_dir}/descriptions.txt", list(descriptions_bkup.keys()) + missing_ents[:i + batchsize], descriptions)
-    print("\n")
-    return ent_ids, descriptions
+    ent_ids, infos = get_entity_info(entities, batchsize)
+    return ent_ids, [info["description"] for info in infos]
 
 
 def get_labels(entities: set[str] | list[str], batchsize: int=20) -> list[str]:
-    print("> Collecting entity labels")
-    global entities_dir, labels_bkup
-    missing_ents = [e for e in entities if e not in labels_bkup]
-    
-    labels = list(labels_bkup.values())
-    ent_ids = list(labels_bkup.keys())
-    for i in range(0, len(missing_ents), batchsize):
-        ents = missing_ents[i:i + batchsize]
-        labels += labels_query(ents)
-        ent_ids += ents
-        ent_ids = missing_ents[:i + batchsize]
-        print(f"({i + len(labels_bkup)}/{len(entities)})", end="\r")
-        if i % (10 * batchsize) == 0:
-            dump(f"{entities_dir}/labels.txt", list(labels_bkup.keys()) + missing_ents[:i + batchsize], labels)
-    print("\n")
-    return ent_ids, labels
+    ent_ids, infos = get_entity_info(entities, batchsize)
+    return ent_ids, [info["label"] for info in infos]
         
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--entities")
+    add_backend_arguments(parser)
+    add_client_arguments(parser)
+    add_cache_arguments(parser)
     args = parser.parse_args()
+    configure_from_args(args)
+    configure_cache_from_args(args)
+    backend = backend_from_args(args)
 
     entities = set(load_entities(args.entities))
     entities_dir = os.path.dirname(args.entities)
@@ -220,15 +178,6 @@ if __name__ == "__main__":
     redirections_bkup = load_backup(f"{entities_dir}/../redirections.txt")
     labels_bkup = load_backup(f"{entities_dir}/labels.txt")
     descriptions_bkup = load_backup(f"{entities_dir}/descriptions.txt")
-    breakpoint()
-    entity_ids, redirections = get_redirections(list(entities))
-    outfile = f"{entities_dir}/../redirections.txt"
-    dump(outfile, entity_ids, redirections)
-    
-    entity_ids, labels = get_labels(list(entities))
-    outfile = f"{entities_dir}/labels.txt"
-    dump(outfile, entity_ids, labels)
-
-    entity_ids, descriptions = get_descriptions(list(entities))
-    outfile = f"{entities_dir}/descriptions.txt"
-    dump(outfile, entity_ids, descriptions)
+    # a single pass collects everything, checkpointing into a journal, and writes the three output files once complete
+    get_entity_info(list(entities), batcher=batcher_from_args(args, initial=20), backend=backend)
+    backend.close()
@@ -0,0 +1,115 @@
+import argparse, json, time
+import numpy as np
+
+from triple_store import TripleStore
+
+
+def connected_components(n_nodes: int, heads: np.ndarray, tails: np.ndarray) -> np.ndarray:
+    # vectorized union-find: every round hooks the larger root of each edge crossing two components onto
+    # the smaller one, then compresses the paths, until no edge crosses; returns the root of every node
+    parent = np.arange(n_nodes, dtype=np.int64)
+    heads = np.asarray(heads, dtype=np.int64)
+    tails = np.asarray(tails, dtype=np.int64)
+    while len(heads) > 0:
+        ph, pt = parent[heads], parent[tails]
+        crossing = ph != pt
+        # edges inside a component stay inside it, they are never visited again
+        heads, tails, ph, pt = heads[crossing], tails[crossing], ph[crossing], pt[crossing]
+        if len(heads) == 0:
+            break
+        parent[np.maximum(ph, pt)] = np.minimum(ph, pt)
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return parent
+
+
+def _distribution(degrees: np.ndarray) -> dict:
+    counts = np.bincount(degrees)
+    return {
+        "mean": float(degrees.mean()) if len(degrees) > 0 else 0.,
+        "max": int(degrees.max()) if len(degrees) > 0 else 0,
+        "histogram": {str(d): int(c) for d, c in enumerate(counts) if c > 0},
+    }
+
+
+def graph_stats(heads: np.ndarray, rels: np.ndarray, tails: np.ndarray, n_nodes: int, idx2rel: list[str], top_k: int=100) -> dict:
+    heads = np.asarray(heads, dtype=np.int64)
+    tails = np.asarray(tails, dtype=np.int64)
+    start = time.time()
+    roots = connected_components(n_nodes, heads, tails)
+    sizes = np.bincount(roots, minlength=n_nodes)
+    sizes = np.sort(sizes[sizes > 0])[::-1]
+    out_degrees = np.bincount(heads, minlength=n_nodes)
+    in_degrees = np.bincount(tails, minlength=n_nodes)
+    relations = np.bincount(np.asarray(rels, dtype=np.int64), minlength=len(idx2rel))
+    pairs = np.sort(heads * n_nodes + tails)
+    return {
+        "nodes": n_nodes,
+        "triplets": len(heads),
+        # distinct (head, tail) pairs, the edges of a simple directed graph
+        "edges": int((pairs[1:] != pairs[:-1]).sum()) + int(len(pairs) > 0),
+        "isolated_nodes": int(((out_degrees + in_degrees) == 0).sum()),
+        "components": len(sizes),
+        "top_component_sizes": sizes[:top_k].tolist(),
+        "out_degree": _distribution(out_degrees),
+        "in_degree": _distribution(in_degrees),
+        "degree": _distribution(out_degrees + in_degrees),
+        "relations": {idx2rel[r]: int(c) for r, c in sorted(enumerate(relations), key=lambda x: -x[1]) if c > 0},
+        "seconds": time.time() - start,
+    }
+
+
+def store_stats(store: TripleStore, top_k: int=100) -> dict:
+    return graph_stats(store.heads, store.rels, store.tails, store.n_entities, store.idx2rel, top_k)
+
+
+def triplets_stats(triplets, entities=None, top_k: int=100) -> dict:
+    # the entities are nodes even when they have no edge
+    ent2idx = {e: i for i, e in enumerate(sorted(entities))} if entities is not None else None
+    return store_stats(TripleStore.from_triplets(triplets, ent2idx), top_k)
+
+
+def print_stats(stats: dict):
+    print(f"""
+    -------------- Graph --------------
+
+    > Number of Nodes: {stats['nodes']}
+    > Number of Edges: {stats['edges']} ({stats['triplets']} triplets, {len(stats['relations'])} relations)
+
+    > Number of connected components: {stats['components']} ({stats['isolated_nodes']} isolated nodes)
+    > Top {len(stats['top_component_sizes'])} connected clusters size: {stats['top_component_sizes']}
+    > Mean degree: {stats['degree']['mean']:.2f}, max in-degree: {stats['in_degree']['max']}, max out-degree: {stats['out_degree']['max']}
+
+    -----------------------------------
+    """)
+
+
+def dump_stats(stats: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(stats, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--graph", help="space separated `head rel tail` triplets file")
+    parser.add_argument("--store", help="triple store directory (see triple_store.py), instead of --graph")
+    parser.add_argument("--entities", help="nodes of the graph, including the ones without edges")
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--outfile", help="json file for the statistics")
+    args = parser.parse_args()
+
+    if args.store is not None:
+        stats = store_stats(TripleStore.load(args.store), args.top_k)
+    else:
+        entities = None
+        if args.entities is not None:
+            with open(args.entities, "r") as f:
+                entities = f.read().splitlines()
+        with open(args.graph, "r") as f:
+            stats = triplets_stats((t for t in map(str.split, f) if len(t) == 3), entities, args.top_k)
+    print_stats(stats)
+    if args.outfile is not None:
+        dump_stats(stats, args.outfile)
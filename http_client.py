@@ -0,0 +1,189 @@
+import asyncio, random, threading, time
+import httpx
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+USER_AGENT = "wikidata-graph-builder (https://github.com/BrunoLiegiBastonLiegi/wikidata-graph-builder)"
+
+
+class HTTPError(RuntimeError):
+
+    def __init__(self, status: int | str, message: str=""):
+        super().__init__(f"{status}: {message}" if message else f"{status}: error.")
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        # timeouts, server errors and queries too large: a smaller batch may go through
+        return not isinstance(self.status, int) or self.status >= 500 or self.status in (413, 414, 431)
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: int=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.blocked_until = 0.
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # nobody gets a token before `seconds` from now, used to honour Retry-After
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0., float(value))
+    except ValueError:
+        return None
+
+
+class HTTPClient:
+    # rate limited and retried requests through one persistent connection pool, with at most `concurrency`
+    # requests in flight
+
+    def __init__(
+            self,
+            concurrency: int=5,
+            rate: float=5.,
+            max_retries: int=8,
+            max_server_retries: int=2,
+            backoff: float=1.,
+            max_backoff: float=60.,
+            timeout: float=65.,
+            headers: dict=None
+    ):
+        self.headers = {"User-Agent": USER_AGENT, **(headers or {})}
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.max_server_retries = max_server_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        # the event loop lives in a background thread, so that the connection pool survives across
+        # the synchronous calls made by the scripts
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._submit(self._setup()).result()
+        self._executor = ThreadPoolExecutor(2 * concurrency)
+
+    async def _setup(self):
+        self._client = httpx.AsyncClient(
+            headers=self.headers,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            timeout=self.timeout,
+            follow_redirects=True
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._bucket = TokenBucket(self.rate, burst=self.concurrency)
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter exponential backoff
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _request(self, url: str, params: dict=None, data: dict=None, json: dict=None) -> httpx.Response:
+        # 429s are retried up to `max_retries` times, timeouts and server errors only `max_server_retries`
+        # times, after which the error is raised so that the caller can split the batch
+        status = None
+        server_errors = 0
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            async with self._semaphore:
+                try:
+                    if data is None and json is None:
+                        r = await self._client.get(url, params=params)
+                    else:
+                        r = await self._client.post(url, params=params, data=data, json=json)
+                except httpx.TransportError as e:
+                    r, status = None, type(e).__name__
+            if r is not None:
+                status = r.status_code
+            if status == 200:
+                return r
+            if status == 429:
+                wait = _retry_after(r)
+                wait = self._backoff(attempt) if wait is None else wait
+                print(f"> 429: too many requests, waiting {wait:.1f}s.")
+                self._bucket.pause(wait)
+            elif r is None or status >= 500:
+                server_errors += 1
+                if server_errors > self.max_server_retries:
+                    raise HTTPError(status, r.text[:200] if r is not None else "")
+                print(f"> {status}: server error, retrying.")
+                await asyncio.sleep(self._backoff(attempt))
+            else:
+                raise HTTPError(status, r.text[:200])
+        raise HTTPError(status, f"giving up after {self.max_retries + 1} attempts")
+
+    async def _fetch_json(self, url: str, missing: tuple, payload: dict=None) -> dict | None | HTTPError:
+        try:
+            r = await self._request(url, json=payload)
+        except HTTPError as e:
+            return None if e.status in missing else e
+        return r.json()
+
+    def _imap(self, coroutines, window: int):
+        pending = deque()
+        for coroutine in coroutines:
+            pending.append(self._submit(coroutine))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+    def get(self, url: str, params: dict=None) -> httpx.Response:
+        return self._submit(self._request(url, params=params)).result()
+
+    def imap_get(self, urls, window: int=None, missing: tuple=(404,)):
+        # ordered json responses, None for the `missing` statuses and the error itself once the retries
+        # are exhausted, so that a failing url does not abort the others
+        window = 4 * self.concurrency if window is None else window
+        yield from self._imap((self._fetch_json(url, missing) for url in urls), window)
+
+    def imap_post(self, url: str, payloads, window: int=None, missing: tuple=(404,)):
+        # same as imap_get, posting every json payload to the url
+        window = 4 * self.concurrency if window is None else window
+        yield from self._imap((self._fetch_json(url, missing, payload) for payload in payloads), window)
+
+    def map_batches(self, fn, batches, window: int=None):
+        # run fn (which queries through this client) over the batches from a thread pool, in order
+        window = 2 * self.concurrency if window is None else window
+        pending = deque()
+        for batch in batches:
+            pending.append(self._executor.submit(fn, batch))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+    def close(self):
+        self._executor.shutdown()
+        self._submit(self._client.aclose()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,96 @@
+import hashlib, time
+
+from cache import get_cache
+from http_client import HTTPClient, HTTPError
+
+
+OLLAMA_HOST = "http://localhost:11434"
+
+
+class OllamaGenerator:
+    # completions from the /api/generate endpoint of an Ollama server, with a bounded number of requests in
+    # flight; every completion is cached as soon as it arrives, so that an interrupted run resumes where it stopped
+
+    def __init__(self, model: str="llama2:13b", host: str=OLLAMA_HOST, concurrency: int=4, rate: float=100., max_retries: int=2, timeout: float=600., options: dict=None, chunksize: int=100):
+        self.model = model
+        self.url = f"{host}/api/generate"
+        self.options = options
+        self.client = HTTPClient(
+            concurrency=concurrency,
+            rate=rate,
+            max_server_retries=max_retries,
+            timeout=timeout,
+            headers={"Accept": "application/json"}
+        )
+        self.chunksize = chunksize
+        self.requests = 0
+        self.cached = 0
+        self.failed = 0
+        self.tokens = 0
+        self.prompt_tokens = 0
+        self.eval_seconds = 0.
+        self.seconds = 0.
+
+    def key(self, entity: str, prompt: str) -> str:
+        return "\t".join((self.model, entity, hashlib.sha1(prompt.encode("utf-8")).hexdigest()))
+
+    def _payload(self, prompt: str) -> dict:
+        payload = {"model": self.model, "prompt": prompt, "stream": False}
+        if self.options is not None:
+            payload["options"] = self.options
+        return payload
+
+    def _generate(self, items: list[tuple[str, str]]) -> dict:
+        cache = get_cache()
+        keys = [self.key(e, p) for e, p in items]
+        generations = cache.get_many("generation", keys)
+        missing = [(k, e, p) for k, (e, p) in zip(keys, items) if k not in generations]
+        self.cached += len(keys) - len(missing)
+        start = time.time()
+        responses = self.client.imap_post(self.url, (self._payload(p) for _, _, p in missing), missing=())
+        for (key, entity, _), response in zip(missing, responses):
+            self.requests += 1
+            if isinstance(response, HTTPError):
+                # not cached, the next run tries again
+                print(f"> {response.status}: generation failed for {entity}")
+                self.failed += 1
+                continue
+            self.tokens += response.get("eval_count", 0)
+            self.prompt_tokens += response.get("prompt_eval_count", 0)
+            self.eval_seconds += response.get("eval_duration", 0) / 1e9
+            generations[key] = response["response"].strip()
+            cache.put_many("generation", {key: generations[key]})
+        self.seconds += time.time() - start
+        return generations
+
+    def imap(self, items):
+        # completion of every (entity, prompt) pair in order, None where the generation failed
+        items = list(items)
+        for i in range(0, len(items), self.chunksize):
+            chunk = items[i:i + self.chunksize]
+            generations = self._generate(chunk)
+            for entity, prompt in chunk:
+                yield generations.get(self.key(entity, prompt))
+
+    def report(self):
+        requests_per_second = self.requests / self.seconds if self.seconds > 0 else 0.
+        tokens_per_second = self.tokens / self.seconds if self.seconds > 0 else 0.
+        eval_rate = f", {self.tokens / self.eval_seconds:.1f} tokens/s per request" if self.eval_seconds > 0 else ""
+        print(
+            f"> {self.model}: {self.requests} requests ({self.failed} failed, {self.cached} cached) at {requests_per_second:.2f} requests/s | "
+            f"{self.tokens} tokens generated at {tokens_per_second:.1f} tokens/s{eval_rate}, {self.prompt_tokens} prompt tokens"
+        )
+
+    def close(self):
+        self.client.close()
+
+
+def add_llm_arguments(parser):
+    parser.add_argument("--model", default="llama2:13b")
+    parser.add_argument("--ollama-host", default=OLLAMA_HOST)
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="maximum number of generations in flight, match OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--llm-timeout", type=float, default=600., help="seconds before a generation is abandoned")
+
+
+def generator_from_args(args) -> OllamaGenerator:
+    return OllamaGenerator(model=args.model, host=args.ollama_host, concurrency=args.llm_concurrency, timeout=args.llm_timeout)
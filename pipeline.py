@@ -0,0 +1,348 @@
+import argparse, ast, hashlib, json, os, subprocess, sys, time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from files import atomic_write
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+DISAMB_DIR = os.path.join(ROOT, "wikidata-disamb")
+
+# where the scripts find the modules they import, whatever directory they run from
+PYTHONPATH = (ROOT, DISAMB_DIR)
+
+DISAMB_SETS = ("train", "dev", "test")
+
+
+class Stage:
+    # one script of the workflow: the command, the directory it runs from, and the files (or directories)
+    # it reads and writes, relative to the root of the repository; the dependencies between the stages
+    # follow from the outputs of one being the inputs of another
+
+    def __init__(self, name: str, command: list[str], inputs: list[str], outputs: list[str], cwd: str="."):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.cwd = cwd
+
+
+def local_modules(script: str, search_path: tuple=PYTHONPATH) -> list[str]:
+    # the script and the modules of the repository it imports, directly or through another one, relative
+    # to the root: a change to any of them changes what the stage produces
+    found, queue = set(), [os.path.abspath(script)]
+    while len(queue) > 0:
+        path = queue.pop()
+        if path in found:
+            continue
+        found.add(path)
+        with open(path, "r") as f:
+            tree = ast.parse(f.read(), path)
+        names = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names.update(alias.name.split(".")[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+                names.add(node.module.split(".")[0])
+        for name in names:
+            for directory in (os.path.dirname(path), *search_path):
+                module = os.path.join(directory, f"{name}.py")
+                if os.path.isfile(module):
+                    queue.append(module)
+                    break
+    return sorted(os.path.relpath(path, ROOT) for path in found)
+
+
+def build_stages(args) -> list[Stage]:
+    d = os.path.relpath(args.data_dir, ROOT)
+
+    def script(path: str, cwd: str=".") -> str:
+        # the scripts of wikidata-disamb run from the data directory, which may be another one
+        return os.path.relpath(os.path.join(ROOT, path), os.path.join(ROOT, cwd))
+
+    code = {name: local_modules(os.path.join(ROOT, name)) for name in (
+        "get_descriptions_and_labels.py",
+        "wikidata-disamb/correct.py",
+        "wikidata/filter_rdf_triplets.py",
+        "to_graph.py",
+        "wikidata-disamb/prepare.py",
+        "generate_descriptions.py"
+    )}
+    original = [f"{d}/original/wikidata-disambig-{s}.json" for s in DISAMB_SETS]
+    corrected = [f"{d}/corrected/wikidata-disambig-{s}.json" for s in DISAMB_SETS]
+    info = [f"{d}/redirections.txt", f"{d}/original/labels.txt", f"{d}/original/descriptions.txt"]
+    corrected_info = [f"{d}/corrected/entity_ids.txt", f"{d}/corrected/labels.txt", f"{d}/corrected/descriptions.txt"]
+    missing_entities = [f"{d}/original/missing_entities.json"] if os.path.exists(f"{ROOT}/{d}/original/missing_entities.json") else []
+    stages = [
+        Stage(
+            "info",
+            [sys.executable, "get_descriptions_and_labels.py", "--entities", f"{d}/original/entity_ids.txt", *args.backend_args],
+            [f"{d}/original/entity_ids.txt", *code["get_descriptions_and_labels.py"]],
+            info
+        ),
+        Stage(
+            "correct",
+            [sys.executable, script("wikidata-disamb/correct.py", d), "--workers", str(args.workers)],
+            [f"{d}/original/entity_ids.txt", *original, *info, *missing_entities, *code["wikidata-disamb/correct.py"]],
+            [*corrected_info, *corrected],
+            cwd=d
+        ),
+    ]
+    rdf = os.path.abspath(args.rdf) if args.rdf is not None else None
+    if args.dump_triplets is not None:
+        # the triplets of the dump touching the corrected entities, the ones the graph is built for
+        rdf = "wikidata/filtered_rdf_triplets.txt"
+        stages.append(Stage(
+            "filter",
+            [sys.executable, "filter_rdf_triplets.py", "--entities", f"../{d}/corrected/entity_ids.txt", "--triplets", os.path.abspath(args.dump_triplets), "--outfile", "filtered_rdf_triplets.txt", "--mode", "either", "--workers", str(args.workers)],
+            [f"{d}/corrected/entity_ids.txt", os.path.abspath(args.dump_triplets), *code["wikidata/filter_rdf_triplets.py"]],
+            [rdf],
+            cwd="wikidata"
+        ))
+    graph_command = [sys.executable, "to_graph.py", "--entities", f"{d}/corrected/entity_ids.txt", "--outfile", f"{d}/corrected/graph.txt", "--workers", str(args.workers), "--stats", f"{d}/corrected/graph_stats.json"]
+    if rdf is not None:
+        graph_command += ["--rdf", rdf]
+    else:
+        graph_command += args.backend_args
+    stages.append(Stage(
+        "graph",
+        graph_command,
+        [f"{d}/corrected/entity_ids.txt", *([rdf] if rdf is not None else []), *code["to_graph.py"]],
+        [f"{d}/corrected/graph.txt", f"{d}/corrected/graph_stats.json"]
+    ))
+    prepare_inputs = [*corrected_info, *corrected, f"{d}/corrected/graph.txt", *code["wikidata-disamb/prepare.py"]]
+    stages.append(Stage(
+        "prepare",
+        [sys.executable, script("wikidata-disamb/prepare.py", d), "--format", args.format],
+        prepare_inputs,
+        [f"{d}/prepared_dataset", f"{d}/prepared_dataset-cut", f"{d}/descriptions_stats.json"],
+        cwd=d
+    ))
+    if args.wikipedia:
+        stages.append(Stage(
+            "wikipedia",
+            [sys.executable, "generate_descriptions.py", f"{d}/corrected/entity_ids.txt", *args.backend_args],
+            [f"{d}/corrected/entity_ids.txt", *code["generate_descriptions.py"]],
+            [f"{d}/corrected/wikipedia_pages.json", f"{d}/corrected/generated_descriptions.json"]
+        ))
+        # its own statistics file, so that it can run at the same time as the prepare stage
+        stages.append(Stage(
+            "prepare-wikipedia",
+            [sys.executable, script("wikidata-disamb/prepare.py", d), "--format", args.format, "--wikipedia", "corrected/wikipedia_pages.json", "--stats", "descriptions_stats_with_wikipedia.json"],
+            [*prepare_inputs, f"{d}/corrected/wikipedia_pages.json"],
+            [f"{d}/prepared_dataset_with_wikipedia", f"{d}/prepared_dataset_with_wikipedia-cut", f"{d}/descriptions_stats_with_wikipedia.json"],
+            cwd=d
+        ))
+    return stages
+
+
+def dependencies(stages: list[Stage]) -> dict:
+    # stage -> the stages writing one of its inputs
+    producers = {}
+    for stage in stages:
+        for path in stage.outputs:
+            if path in producers:
+                raise RuntimeError(f"{path} is an output of both {producers[path]} and {stage.name}.")
+            producers[path] = stage.name
+    return {
+        stage.name: {producers[path] for path in stage.inputs if path in producers and producers[path] != stage.name}
+        for stage in stages
+    }
+
+
+class Hasher:
+    # sha256 of files and directories, memoized on (size, mtime) across runs through the state file, so
+    # that unchanged multi-gigabyte inputs (the dump triplets) are not read again
+
+    def __init__(self, known: dict=None):
+        self.known = {} if known is None else known
+
+    def file(self, path: str) -> str:
+        stat = os.stat(path)
+        key = f"{stat.st_size}:{stat.st_mtime_ns}"
+        known = self.known.get(path)
+        if known is not None and known[0] == key:
+            return known[1]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        self.known[path] = (key, digest.hexdigest())
+        return self.known[path][1]
+
+    def path(self, path: str) -> str:
+        # None for a missing path, so that a stage whose outputs were deleted is run again
+        full_path = os.path.join(ROOT, path)
+        if os.path.isfile(full_path):
+            return self.file(full_path)
+        if not os.path.isdir(full_path):
+            return None
+        digest = hashlib.sha256()
+        for dirpath, dirnames, filenames in os.walk(full_path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                file_path = os.path.join(dirpath, filename)
+                digest.update(f"{os.path.relpath(file_path, full_path)}\0{self.file(file_path)}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    def paths(self, paths: list[str]) -> dict:
+        return {path: self.path(path) for path in paths}
+
+
+def fingerprint(stage: Stage, hasher: Hasher) -> str:
+    # the command and the content of the inputs, the code of the stage among them
+    digest = hashlib.sha256(json.dumps([stage.command[1:], stage.cwd]).encode("utf-8"))
+    for path, h in sorted(hasher.paths(stage.inputs).items()):
+        digest.update(f"{path}\0{h}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_state(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"stages": {}, "hashes": {}}
+
+
+def dump_state(state: dict, path: str):
+    with atomic_write(path) as f:
+        json.dump(state, f, indent=2)
+
+
+def run_stage(stage: Stage, log_dir: str) -> dict:
+    # the stage in its own process, its output in <log_dir>/<stage>.log; wait4 gives the peak resident
+    # memory of the process (and of the children it waited for, e.g. the workers of a pool)
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"{stage.name}.log")
+    start = time.time()
+    path = [*PYTHONPATH, os.environ["PYTHONPATH"]] if os.environ.get("PYTHONPATH") else list(PYTHONPATH)
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(path)}
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(stage.command, cwd=os.path.join(ROOT, stage.cwd), stdout=log, stderr=subprocess.STDOUT, env=env)
+        _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "returncode": process.returncode,
+        "seconds": time.time() - start,
+        # kilobytes on linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "log": log_path,
+    }
+
+
+def run_pipeline(stages: list[Stage], state_path: str, log_dir: str, jobs: int=2, force: set[str]=None, dry_run: bool=False) -> dict:
+    # the stages whose dependencies are done are started as soon as a slot is free; a stage is skipped
+    # when its command and inputs hash as in its last successful run and its outputs are unchanged
+    force = set() if force is None else force
+    # the same bound for the scheduling and the executor, with no slot nothing would ever start
+    jobs = max(jobs, 1)
+    state = load_state(state_path)
+    hasher = Hasher({path: tuple(known) for path, known in state.get("hashes", {}).items()})
+    deps = dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    pending = [stage.name for stage in stages]
+    done, failed, report = set(), set(), {}
+    running = {}
+
+    def save():
+        state["hashes"] = hasher.known
+        dump_state(state, state_path)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            for name in list(pending):
+                if deps[name] & failed:
+                    pending.remove(name)
+                    failed.add(name)
+                    report[name] = {"status": "not run", "reason": f"failed dependencies: {sorted(deps[name] & failed)}"}
+                    print(f"> {name}: not run, {report[name]['reason']}")
+                    continue
+                if not deps[name] <= done or len(running) >= jobs:
+                    continue
+                pending.remove(name)
+                stage = by_name[name]
+                previous = state["stages"].get(name)
+                key = fingerprint(stage, hasher)
+                if name not in force and previous is not None and previous["fingerprint"] == key and previous["outputs"] == hasher.paths(stage.outputs):
+                    done.add(name)
+                    report[name] = {"status": "skipped"}
+                    print(f"> {name}: unchanged inputs, skipped")
+                    continue
+                if dry_run:
+                    done.add(name)
+                    report[name] = {"status": "would run", "command": " ".join(stage.command)}
+                    print(f"> {name}: would run `{' '.join(stage.command)}` in {stage.cwd}")
+                    continue
+                print(f"> {name}: running `{' '.join(stage.command)}` in {stage.cwd}")
+                running[executor.submit(run_stage, stage, log_dir)] = (name, key)
+            if len(running) == 0:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, key = running.pop(future)
+                result = future.result()
+                if result["returncode"] == 0:
+                    done.add(name)
+                    result["status"] = "done"
+                    state["stages"][name] = {
+                        "fingerprint": key,
+                        "outputs": hasher.paths(by_name[name].outputs),
+                        **{k: result[k] for k in ("seconds", "peak_rss_mb", "cpu_seconds")},
+                        "ts": time.time(),
+                    }
+                    save()
+                else:
+                    failed.add(name)
+                    result["status"] = "failed"
+                report[name] = result
+                print(f"> {name}: {result['status']} in {result['seconds']:.1f}s, peak RSS {result['peak_rss_mb']:.0f} MB (log: {result['log']})")
+    save()
+    return report
+
+
+def print_report(report: dict):
+    print("\n    stage                 status       seconds   peak RSS (MB)")
+    for name, result in report.items():
+        seconds = f"{result['seconds']:.1f}" if "seconds" in result else "-"
+        rss = f"{result['peak_rss_mb']:.0f}" if "peak_rss_mb" in result else "-"
+        print(f"    {name:<20}  {result['status']:<10}  {seconds:>9}  {rss:>14}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="labels and descriptions -> corrected dataset -> graph -> prepared dataset, re-running only the stages whose inputs changed")
+    parser.add_argument("--data-dir", default=os.path.join(ROOT, "wikidata-disamb"))
+    parser.add_argument("--rdf", help="triplets file (or triple store) to build the graph from, instead of querying")
+    parser.add_argument("--dump-triplets", help="rdf triplets of a full dump, filtered around the corrected entities before the graph is built")
+    parser.add_argument("--wikipedia", action="store_true", help="also fetch wikipedia pages, generate the missing descriptions and prepare the dataset with them")
+    parser.add_argument("--format", default="json", help="output format of the prepared datasets (see wikidata-disamb/formats.py)")
+    parser.add_argument("--workers", type=int, default=1, help="processes used within a stage")
+    parser.add_argument("--jobs", type=int, default=2, help="stages run at the same time")
+    parser.add_argument("--force", nargs="*", default=[], help="stages to run even if their inputs did not change")
+    parser.add_argument("--only", nargs="*", help="run these stages only (their dependencies must be up to date)")
+    parser.add_argument("--dry-run", action="store_true", help="print the stages that would run")
+    parser.add_argument("--state", help="json file of the stage hashes and timings (default: <data-dir>/pipeline_state.json)")
+    parser.add_argument("--report", help="json file for the timings and peak memory of this run")
+    parser.add_argument("--backend-args", nargs=argparse.REMAINDER, default=[], help="passed to the querying stages (see backends.py), must come last")
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    stages = build_stages(args)
+    if args.only is not None:
+        unknown = set(args.only) - {stage.name for stage in stages}
+        if len(unknown) > 0:
+            raise RuntimeError(f"Unknown stages: {sorted(unknown)}, use some of {[stage.name for stage in stages]}.")
+        stages = [stage for stage in stages if stage.name in args.only]
+    state_path = args.state if args.state is not None else os.path.join(args.data_dir, "pipeline_state.json")
+    start = time.time()
+    report = run_pipeline(stages, state_path, os.path.join(args.data_dir, "logs"), args.jobs, set(args.force), args.dry_run)
+    print_report(report)
+    print(f"> Pipeline done in {time.time() - start:.1f}s")
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    if any(result["status"] in ("failed", "not run") for result in report.values()):
+        sys.exit(1)
@@ -0,0 +1,109 @@
+import os, sqlite3, time
+
+from files import atomic_path, build_lock, is_stale
+
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS triplets (
+  head INTEGER NOT NULL,
+  rel INTEGER NOT NULL,
+  tail INTEGER NOT NULL
+)"""
+
+INDICES = (
+    "CREATE INDEX IF NOT EXISTS head_idx ON triplets (head, rel, tail)",
+    "CREATE INDEX IF NOT EXISTS tail_idx ON triplets (tail, rel, head)",
+)
+
+
+def _to_int(_id: str) -> int:
+    return int(_id[1:])
+
+
+def build_rdf_index(rdf_path: str, index_path: str, batchsize: int=1000000):
+    with atomic_path(index_path) as tmp_path:
+        db = sqlite3.connect(tmp_path)
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute(SCHEMA)
+        start = time.time()
+        n_triplets = 0
+        batch = []
+        with open(rdf_path, "r") as f:
+            for line in f:
+                line = line.split()
+                if len(line) != 3:
+                    continue
+                head, rel, tail = line
+                batch.append((_to_int(head), _to_int(rel), _to_int(tail)))
+                if len(batch) == batchsize:
+                    db.executemany("INSERT INTO triplets VALUES (?, ?, ?)", batch)
+                    n_triplets += len(batch)
+                    batch = []
+                    print(f"> Indexing RDF triplets. ({n_triplets})", end="\r")
+        db.executemany("INSERT INTO triplets VALUES (?, ?, ?)", batch)
+        n_triplets += len(batch)
+        print(f"> Indexing RDF triplets. ({n_triplets})")
+        print("> Building head and tail indices")
+        for index in INDICES:
+            db.execute(index)
+        db.commit()
+        db.close()
+    print(f"> Indexed {n_triplets} triplets in {time.time() - start:.1f}s: {index_path}")
+
+
+class RDFIndex:
+
+    def __init__(self, index_path: str):
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(index_path)
+        self.db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _edges(self, column: str, entities: list[str], batchsize: int):
+        # the triplets only link Q entities, properties never appear as head or tail
+        entities = [e for e in entities if e.startswith("Q")]
+        for i in range(0, len(entities), batchsize):
+            ids = [_to_int(e) for e in entities[i:i + batchsize]]
+            placeholders = ", ".join("?" for _ in ids)
+            yield from self.db.execute(
+                f"SELECT head, rel, tail FROM triplets WHERE {column} IN ({placeholders})",
+                ids
+            )
+
+    def out_edges(self, entities: list[str], batchsize: int=500):
+        for head, rel, tail in self._edges("head", entities, batchsize):
+            yield (f"Q{head}", f"P{rel}", f"Q{tail}")
+
+    def in_edges(self, entities: list[str], batchsize: int=500):
+        for head, rel, tail in self._edges("tail", entities, batchsize):
+            yield (f"Q{head}", f"P{rel}", f"Q{tail}")
+
+    def subgraph(self, entities: set[str], heads: list[str]=None) -> list[tuple]:
+        # only the adjacency lists of the requested heads (default: all the entities) are visited
+        entities = set(entities)
+        tails = {_to_int(e) for e in entities if e.startswith("Q")}
+        return [
+            (f"Q{head}", f"P{rel}", f"Q{tail}")
+            for head, rel, tail in self._edges("head", entities if heads is None else heads, 500)
+            if tail in tails
+        ]
+
+
+def open_rdf_index(rdf_path: str, index_path: str=None) -> RDFIndex:
+    if index_path is None:
+        index_path = f"{rdf_path}.idx"
+    # rebuilt when the triplets were rewritten since, an old index would silently give the old edges
+    if is_stale(index_path, rdf_path):
+        with build_lock(index_path):
+            # another process may have built it while this one was waiting
+            if is_stale(index_path, rdf_path):
+                build_rdf_index(rdf_path, index_path)
+    return RDFIndex(index_path)
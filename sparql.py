@@ -0,0 +1,170 @@
+import math, threading, time
+
+from http_client import HTTPClient, HTTPError
+
+
+SPARQL_ENDPOINT = "https://query.wikidata.org/bigdata/namespace/wdq/sparql"
+
+
+class SPARQLClient(HTTPClient):
+
+    def __init__(self, endpoint: str=SPARQL_ENDPOINT, headers: dict=None, **kwargs):
+        super().__init__(headers={"Accept": "application/sparql-results+json", **(headers or {})}, **kwargs)
+        self.endpoint = endpoint
+
+    async def _query(self, query: str) -> dict:
+        # long queries go in the body, they would not fit in the url
+        if len(query) > 4096:
+            r = await self._request(self.endpoint, params={"format": "json"}, data={"query": query})
+        else:
+            r = await self._request(self.endpoint, params={"format": "json", "query": query})
+        return r.json()
+
+    def query(self, query: str) -> dict:
+        return self._submit(self._query(query)).result()
+
+    def imap(self, queries, window: int=None):
+        # ordered results, with at most `window` queries submitted ahead of the consumer
+        window = 2 * self.concurrency if window is None else window
+        yield from self._imap((self._query(q) for q in queries), window)
+
+
+class AdaptiveBatcher:
+    # grows the batches while their latency stays under the target, halves them on retryable errors,
+    # splitting the failed batch in two halves that are retried instead of aborting the whole run; a
+    # failure also sets a ceiling below the size that failed, which the batches do not grow past and
+    # which only relaxes by `relax` per successful batch, so that the same size is not tried again and again
+
+    def __init__(self, initial: int=20, minimum: int=1, maximum: int=500, target_latency: float=5., growth: float=1.25, relax: float=0.001):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.ceiling = float(maximum)
+        self.relax = relax
+        self.target_latency = target_latency
+        self.growth = growth
+        self.latencies = []
+        self.sizes = []
+        self.splits = 0
+        self.lock = threading.Lock()
+
+    def _succeeded(self, size: int, latency: float):
+        with self.lock:
+            self.latencies.append(latency)
+            self.sizes.append(size)
+            self.ceiling = min(self.maximum, self.ceiling * (1 + self.relax))
+            if latency < self.target_latency:
+                self.size = min(int(self.ceiling), max(self.size, math.ceil(size * self.growth)))
+            elif latency > 2 * self.target_latency:
+                self.size = max(self.minimum, min(self.size, int(size / self.growth)))
+
+    def _failed(self, size: int, error: HTTPError):
+        with self.lock:
+            self.splits += 1
+            self.ceiling = max(self.minimum, min(self.ceiling, size / self.growth))
+            self.size = max(self.minimum, min(self.size, size // 2))
+        print(f"> {error.status}: splitting a batch of {size}.")
+
+    def _run(self, fn, batch: list) -> list:
+        start = time.monotonic()
+        try:
+            result = list(fn(batch))
+        except HTTPError as e:
+            if not e.retryable or len(batch) <= 1:
+                raise
+            self._failed(len(batch), e)
+            half = len(batch) // 2
+            return self._run(fn, batch[:half]) + self._run(fn, batch[half:])
+        self._succeeded(len(batch), time.monotonic() - start)
+        return result
+
+    def map(self, fn, items: list, client: SPARQLClient=None):
+        # fn takes a batch of items and returns one result per item, (batch, results) are yielded in order
+        client = get_client() if client is None else client
+        items = list(items)
+
+        def batches():
+            i = 0
+            while i < len(items):
+                size = self.size
+                yield items[i:i + size]
+                i += size
+
+        yield from client.map_batches(lambda batch: (batch, self._run(fn, batch)), batches())
+
+    def stats(self) -> dict:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            if len(latencies) == 0:
+                return {"batches": 0, "splits": self.splits, "batchsize": self.size, "ceiling": int(self.ceiling)}
+            return {
+                "batches": len(latencies),
+                "splits": self.splits,
+                "batchsize": self.size,
+                "ceiling": int(self.ceiling),
+                "mean_batchsize": sum(self.sizes) / len(self.sizes),
+                "mean_latency": sum(latencies) / len(latencies),
+                "p50_latency": latencies[len(latencies) // 2],
+                "p95_latency": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+                "max_latency": latencies[-1],
+                "items_per_second": sum(self.sizes) / sum(latencies) if sum(latencies) > 0 else None,
+            }
+
+    def report(self):
+        stats = self.stats()
+        if stats["batches"] == 0:
+            return
+        print(
+            f"> {stats['batches']} batches ({stats['splits']} splits), mean size {stats['mean_batchsize']:.1f}, final size {stats['batchsize']} | "
+            f"latency mean {stats['mean_latency']:.2f}s, p50 {stats['p50_latency']:.2f}s, p95 {stats['p95_latency']:.2f}s, max {stats['max_latency']:.2f}s"
+        )
+
+
+_client = None
+
+
+def configure(**kwargs) -> SPARQLClient:
+    global _client
+    if _client is not None:
+        _client.close()
+    _client = SPARQLClient(**kwargs)
+    return _client
+
+
+def get_client() -> SPARQLClient:
+    global _client
+    if _client is None:
+        _client = SPARQLClient()
+    return _client
+
+
+def add_client_arguments(parser):
+    parser.add_argument("--endpoint", default=SPARQL_ENDPOINT)
+    parser.add_argument("--concurrency", type=int, default=5, help="maximum number of queries in flight")
+    parser.add_argument("--rate", type=float, default=5., help="maximum number of queries per second")
+    parser.add_argument("--batchsize", type=int, help="initial number of items per query")
+    parser.add_argument("--max-batchsize", type=int, default=500)
+    parser.add_argument("--target-latency", type=float, default=5., help="batches grow while their queries take less than this many seconds")
+
+
+def configure_from_args(args, workers: int=1) -> SPARQLClient:
+    # --concurrency and --rate are limits for the whole run, shared by the clients of `workers` processes
+    return configure(endpoint=args.endpoint, concurrency=max(1, args.concurrency // workers), rate=args.rate / workers)
+
+
+def batcher_from_args(args, initial: int) -> AdaptiveBatcher:
+    return AdaptiveBatcher(
+        initial=args.batchsize if args.batchsize is not None else initial,
+        maximum=args.max_batchsize,
+        target_latency=args.target_latency
+    )
+
+
+def first_bindings(response: dict, variables: list[str]) -> list[str]:
+    # first value bound to each of the variables, None if never bound
+    data = {v: None for v in variables}
+    for b in response["results"]["bindings"]:
+        for v, val in b.items():
+            if v in data and data[v] is None:
+                data[v] = val["value"]
+    return [data[v] for v in variables]
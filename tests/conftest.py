@@ -0,0 +1,19 @@
+import os, sys
+import pytest
+
+# the scripts import each other as top level modules, from the root and from wikidata-disamb
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "wikidata-disamb")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import cache
+
+
+@pytest.fixture
+def tmp_cache(tmp_path, monkeypatch):
+    # a cache of its own for every test, instead of the one in the home directory
+    c = cache.Cache(str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(cache, "_cache", c)
+    yield c
+    c.close()
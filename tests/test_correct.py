@@ -0,0 +1,116 @@
+import copy, json, os
+import pytest
+
+from tokenizers import ByteLevelBPETokenizer
+from transformers import AutoTokenizer, PreTrainedTokenizerFast
+
+import correct
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wikidata-disamb")
+
+
+# labels found with a desinence or not found at all, besides the dev samples
+EXTRA_SAMPLES = [
+    {"string": "violin", "text": " she played the violins in the orchestra of the city ."},
+    {"string": "Portugal", "text": " the portuguese navy sailed along the coast of africa ."},
+    {"string": "xylophone", "text": " nothing in this sentence is about music ."},
+    {"string": "Mars", "text": " the rover landed on the red planet in 2021 ."},
+]
+
+
+def baseline_find_entity_span(entity_mention, entity, allow_recursion=True):
+    # the sequential search that find_entity_spans replaced, kept as it was (numpy arrays instead of
+    # torch tensors) as the reference of the labels
+    tokenizer = correct.tokenizer
+    l = entity.shape[-1]
+    i = 0
+    ent = tokenizer.decode(entity.ravel())
+    while i + l <= entity_mention.shape[-1]:
+        if all(entity_mention[0][i:i+l] == entity[0]):
+            return (i, i+l), ent
+        i += 1
+    # try with a space in front
+    if ent[0] != " " and allow_recursion:
+        ent = tokenizer(f" {ent.lower()}", add_special_tokens=False, return_tensors="np").input_ids
+        return baseline_find_entity_span(entity_mention, ent)
+    # some labels don't precisely coincide with the words in the text
+    else:
+        # they miss the final s, n or ed for instance
+        desinences = ("s", "n", f"{ent[-1]}ed", "ic", "en", "es", "ns", "er", "ation", "ing", "ed", f"{ent[-1]}ing", "al", "\"", "ern", "h", "e", "te", "ian", "tic", "an", "rs", "nese", "lary", "vian", "ans")
+        for desinence in desinences:
+            if ent[-1] != desinence and allow_recursion:
+                span = baseline_find_entity_span(
+                    entity_mention,
+                    tokenizer(f"{ent}{desinence}", add_special_tokens=False, return_tensors="np").input_ids,
+                    False
+                )
+                if span is not None:
+                    return span, f"{ent}{desinence}"
+
+
+def baseline_label(sample: dict) -> str | None:
+    # None where the baseline fails: it unpacks the span of a label that was not found
+    tokenizer = correct.tokenizer
+    entity_mention = correct.normalize_mention(sample["text"])
+    tokenized_mention = tokenizer(entity_mention, add_special_tokens=False, return_tensors="np")
+    tokenized_entity = tokenizer(sample["string"].lower(), add_special_tokens=False, return_tensors="np")
+    found = baseline_find_entity_span(tokenized_mention.input_ids, tokenized_entity.input_ids)
+    return found[1] if found is not None else None
+
+
+@pytest.fixture(scope="module")
+def samples() -> list[dict]:
+    with open(os.path.join(DATA_DIR, "original", "wikidata-disambig-dev.json"), "r") as f:
+        data = json.load(f)
+    return data[:60] + EXTRA_SAMPLES
+
+
+@pytest.fixture(scope="module")
+def tokenizer_path(samples, tmp_path_factory) -> str:
+    # a small byte level BPE like gpt2's, trained on the samples, so that no download is needed
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator([s["text"].lower() for s in samples], vocab_size=400, min_frequency=2, show_progress=False)
+    path = str(tmp_path_factory.mktemp("tokenizer"))
+    PreTrainedTokenizerFast(tokenizer_object=bpe).save_pretrained(path)
+    return path
+
+
+@pytest.fixture
+def tokenizer(tokenizer_path, monkeypatch):
+    monkeypatch.setattr(correct, "tokenizer", AutoTokenizer.from_pretrained(tokenizer_path), raising=False)
+    return tokenizer_path
+
+
+@pytest.fixture
+def expected(samples, tokenizer) -> list[str | None]:
+    return [baseline_label(s) for s in samples]
+
+
+def test_not_found_labels_are_covered(expected):
+    assert None in expected
+    assert sum(label is not None for label in expected) > 50
+
+
+def test_per_sample_labels_match_baseline(samples, expected, tokenizer):
+    for sample, label in zip(samples, expected):
+        if label is None:
+            with pytest.raises(TypeError):
+                correct.fix_string_label(dict(sample))
+        else:
+            assert correct.fix_string_label(dict(sample))["string"] == label
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batched_labels_match_baseline(samples, expected, tokenizer, workers):
+    found = [s for s, label in zip(samples, expected) if label is not None]
+    fixed = correct.fix_string_labels(copy.deepcopy(found), batch_size=7, workers=workers, tokenizer_name=tokenizer)
+    assert [s["string"] for s in fixed] == [label for label in expected if label is not None]
+    assert [s["text"] for s in fixed] == [s["text"] for s in found]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batched_labels_fail_like_baseline(samples, expected, tokenizer, workers):
+    # a label that is not found stops the run, as it did in the sequential loop
+    with pytest.raises(TypeError):
+        correct.fix_string_labels(copy.deepcopy(samples), batch_size=7, workers=workers, tokenizer_name=tokenizer)
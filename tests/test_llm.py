@@ -0,0 +1,110 @@
+import json, threading, time
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm import OllamaGenerator
+
+
+class StubOllama(ThreadingHTTPServer):
+    # /api/generate answering every prompt with its upper case, slowly enough for the requests to overlap,
+    # failing the prompts in `failing` with a server error
+
+    daemon_threads = True
+
+    def __init__(self, delay: float=0.05):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.delay = delay
+        self.failing = set()
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.prompts.append(payload["prompt"])
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        if payload["prompt"] in server.failing:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps({"response": payload["prompt"].upper(), "eval_count": 1}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = StubOllama()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_cache):
+    return tmp_cache
+
+
+ITEMS = [(f"Q{i}", f"prompt {i}") for i in range(12)]
+
+
+def generate(server, items=ITEMS, concurrency: int=3) -> tuple[list, OllamaGenerator]:
+    # a new generator per run, as a new process would, only the cache is shared
+    generator = OllamaGenerator(model="stub", host=server.host, concurrency=concurrency, rate=1000., max_retries=0)
+    try:
+        return list(generator.imap(items)), generator
+    finally:
+        generator.close()
+
+
+def test_bounded_concurrency(server):
+    generations, generator = generate(server, concurrency=3)
+    assert generations == [p.upper() for _, p in ITEMS]
+    assert generator.requests == len(ITEMS)
+    assert 1 < server.max_in_flight <= 3
+
+
+def test_second_run_is_cached(server):
+    generate(server)
+    server.prompts.clear()
+    generations, generator = generate(server)
+    assert generations == [p.upper() for _, p in ITEMS]
+    assert server.prompts == []
+    assert generator.requests == 0
+    assert generator.cached == len(ITEMS)
+
+
+def test_failed_prompts_are_retried(server):
+    server.failing = {"prompt 3", "prompt 7"}
+    generations, generator = generate(server)
+    assert generations == [None if p in server.failing else p.upper() for _, p in ITEMS]
+    assert generator.failed == 2
+    server.failing = set()
+    server.prompts.clear()
+    generations, generator = generate(server)
+    assert generations == [p.upper() for _, p in ITEMS]
+    assert sorted(server.prompts) == ["prompt 3", "prompt 7"]
+    assert generator.failed == 0
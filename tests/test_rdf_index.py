@@ -0,0 +1,20 @@
+import os, subprocess, sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OPEN_INDEX = "import sys; from rdf_index import open_rdf_index; index = open_rdf_index(sys.argv[1]); print(sorted(index.out_edges(['Q1']))); index.close()"
+
+
+def test_concurrent_opens_build_the_index_once(tmp_path):
+    # the tasks of an array job opening the same triplets at the same time
+    rdf = tmp_path / "rdf_triplets.txt"
+    rdf.write_text("".join(f"Q{i % 500} P{i % 7} Q{i}\n" for i in range(200000)))
+    processes = [
+        subprocess.Popen([sys.executable, "-c", OPEN_INDEX, str(rdf)], cwd=ROOT, stdout=subprocess.PIPE, text=True)
+        for _ in range(4)
+    ]
+    outputs = [p.communicate()[0] for p in processes]
+    assert all(p.returncode == 0 for p in processes)
+    assert sum(output.count("> Indexed") for output in outputs) == 1
+    assert len({output.splitlines()[-1] for output in outputs}) == 1
@@ -0,0 +1,42 @@
+import pytest
+
+from http_client import HTTPClient, HTTPError
+from sparql import AdaptiveBatcher
+
+
+LIMIT = 150
+
+
+class LimitedServer:
+    # answers the batches of at most LIMIT items, like an endpoint rejecting the queries too large
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+
+    def __call__(self, batch: list) -> list:
+        self.calls += 1
+        if len(batch) > LIMIT:
+            self.failures += 1
+            raise HTTPError(413, "query too large")
+        return [item * 2 for item in batch]
+
+
+@pytest.fixture
+def client():
+    client = HTTPClient(concurrency=1)
+    yield client
+    client.close()
+
+
+def test_failures_are_bounded(client):
+    server = LimitedServer()
+    batcher = AdaptiveBatcher(initial=20, maximum=500, target_latency=60.)
+    items = list(range(50000))
+    results = [r for _, batch_results in batcher.map(server, items, client) for r in batch_results]
+    assert results == [item * 2 for item in items]
+    # a size that failed is only tried again once the ceiling has relaxed, a couple hundred batches later;
+    # every probe fails twice, for the batch already submitted behind the failing one
+    assert server.failures <= 6
+    assert batcher.splits == server.failures
+    assert batcher.size <= LIMIT
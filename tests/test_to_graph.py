@@ -0,0 +1,103 @@
+import json, re, threading
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import sparql
+from backends import SPARQLBackend
+from to_graph import construct_edges_touching
+
+
+ENTITY = "http://www.wikidata.org/entity/"
+PROPERTY = "http://www.wikidata.org/prop/direct/"
+
+HUB = "Q5"
+# every entity from this one on is an instance of the hub, a million incoming edges
+HUB_INSTANCES = 1000000
+
+EDGES = [("Q1", "P1", "Q2"), ("Q3", "P1", HUB), (HUB, "P31", "Q1"), ("Q2", "P1", "Q4")]
+
+
+def edges_of(heads: list[str], tails: list[str]) -> list[tuple]:
+    edges = [(h, r, t) for h, r, t in EDGES if (heads is None or h in heads) and (tails is None or t in tails)]
+    if heads is not None and (tails is None or HUB in tails):
+        edges += [(h, "P31", HUB) for h in heads if int(h[1:]) >= HUB_INSTANCES]
+    return edges
+
+
+class StubSPARQL(ThreadingHTTPServer):
+    # the VALUES blocks of the edge queries evaluated over EDGES and the hub, the incoming edges of the
+    # hub without a bound on the heads time out like they would on the real endpoint
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubSPARQLHandler)
+        self.queries = []
+        self.timeouts = 0
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/sparql"
+
+
+class StubSPARQLHandler(BaseHTTPRequestHandler):
+
+    def _values(self, query: str, var: str) -> list[str] | None:
+        found = re.search(r"VALUES \?" + var + r" \{([^}]*)\}", query)
+        return None if found is None else [e.replace("wd:", "") for e in found.group(1).split()]
+
+    def _answer(self, query: str):
+        server = self.server
+        server.queries.append(query)
+        heads, tails = self._values(query, "h"), self._values(query, "t")
+        if heads is None and (tails is None or HUB in tails):
+            server.timeouts += 1
+            self.send_response(500)
+            self.end_headers()
+            return
+        bindings = [
+            {"h": {"value": ENTITY + h}, "p": {"value": PROPERTY + r}, "t": {"value": ENTITY + t}}
+            for h, r, t in edges_of(heads, tails)
+        ]
+        body = json.dumps({"head": {"vars": ["h", "p", "t"]}, "results": {"bindings": bindings}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/sparql-results+json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._answer(parse_qs(urlparse(self.path).query)["query"][0])
+
+    def do_POST(self):
+        self._answer(parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))["query"][0])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_cache, monkeypatch):
+    server = StubSPARQL()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(sparql, "_client", None)
+    client = sparql.configure(endpoint=server.endpoint, concurrency=2, rate=1000., max_server_retries=0)
+    yield server
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_edges_towards_a_hub(server):
+    # the hub is added to entities among which some of its million instances
+    previous = {"Q1", "Q2", "Q3", "Q4", *(f"Q{HUB_INSTANCES + i}" for i in range(0, 3000, 7))}
+    entities = previous | {HUB}
+    batcher = sparql.AdaptiveBatcher(initial=100)
+    edges = construct_edges_touching({HUB}, entities, query=True, batcher=batcher, backend=SPARQLBackend())
+    expected = [(h, r, t) for h, r, t in edges_of(sorted(entities), None) if HUB in (h, t) and h in entities and t in entities]
+    assert sorted(edges) == sorted(expected)
+    assert server.timeouts == 0
+    assert batcher.splits == 0
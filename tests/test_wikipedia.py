@@ -0,0 +1,63 @@
+import json, threading
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import wikipedia
+from wikipedia import WikipediaFetcher, summary_url
+
+
+PAGES = {"AC%2FDC": "AC/DC are an Australian rock band.", "Caf%C3%A9": "A café serves coffee."}
+
+
+class StubSummaryHandler(BaseHTTPRequestHandler):
+    # the REST summary api: a title per path segment, 404 for the unknown ones
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        extract = PAGES.get(self.path.rsplit("/summary/", 1)[-1])
+        if extract is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps({"extract": extract}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_cache, monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSummaryHandler)
+    server.paths = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(wikipedia, "SUMMARY_API", f"http://127.0.0.1:{server.server_port}/api/rest_v1/page/summary/")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_summary_url_encodes_the_title():
+    assert summary_url("https://en.wikipedia.org/wiki/AC/DC").endswith("/summary/AC%2FDC")
+    # already encoded sitelinks are not encoded twice
+    assert summary_url("https://en.wikipedia.org/wiki/Caf%C3%A9").endswith("/summary/Caf%C3%A9")
+    assert summary_url("https://en.wikipedia.org/wiki/Café").endswith("/summary/Caf%C3%A9")
+    assert summary_url("https://en.wikipedia.org/wiki/AC%2FDC").endswith("/summary/AC%2FDC")
+
+
+def test_slash_title_is_fetched(server, tmp_cache):
+    links = ["https://en.wikipedia.org/wiki/AC/DC", "https://en.wikipedia.org/wiki/Caf%C3%A9", "https://en.wikipedia.org/wiki/Missing"]
+    fetcher = WikipediaFetcher(concurrency=2, rate=1000.)
+    try:
+        extracts = fetcher.fetch(links)
+    finally:
+        fetcher.close()
+    assert extracts == [PAGES["AC%2FDC"], PAGES["Caf%C3%A9"], None]
+    assert any(path.endswith("/summary/AC%2FDC") for path in server.paths)
+    assert tmp_cache.get_many("wikipedia_extract", links[:1]) == {links[0]: PAGES["AC%2FDC"]}
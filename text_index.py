@@ -0,0 +1,114 @@
+import mmap, os, time
+import numpy as np
+
+from files import atomic_path, build_lock, is_stale
+
+
+def iter_id_text(path: str, entities: set[str]=None):
+    # `id text` lines split on the first space, streamed so that memory does not grow with the file size;
+    # only the requested entities are kept if any
+    with open(path, "r") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if len(line) <= 1:
+                continue
+            _id, _, data = line.partition(" ")
+            if entities is not None and _id not in entities:
+                continue
+            yield _id, data
+
+
+def _sorted_keys(keys: list[np.ndarray], offsets: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    # keys sorted for binary search, the offsets of a repeated key stay in file order
+    width = max((k.dtype.itemsize for k in keys), default=1)
+    keys = np.concatenate([k.astype(f"S{width}") for k in keys]) if len(keys) > 0 else np.zeros(0, dtype="S1")
+    offsets = np.concatenate(offsets) if len(offsets) > 0 else np.zeros(0, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    return keys[order], offsets[order]
+
+
+def build_text_index(path: str, index_path: str, batchsize: int=1000000):
+    # two arrays saved as .npy: the sorted ids (fixed width bytes) and the byte offset of their line
+    with atomic_path(index_path) as tmp_path:
+        os.makedirs(tmp_path)
+        start = time.time()
+        keys, offsets = [], []
+        batch_keys, batch_offsets = [], []
+        position = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if len(line.rstrip(b"\n")) > 1:
+                    batch_keys.append(line.split(b" ", 1)[0].rstrip(b"\r\n"))
+                    batch_offsets.append(position)
+                    if len(batch_keys) == batchsize:
+                        keys.append(np.asarray(batch_keys, dtype=bytes))
+                        offsets.append(np.asarray(batch_offsets, dtype=np.int64))
+                        batch_keys, batch_offsets = [], []
+                        print(f"> Indexing {path}. ({len(keys) * batchsize})", end="\r")
+                position += len(line)
+        if len(batch_keys) > 0:
+            keys.append(np.asarray(batch_keys, dtype=bytes))
+            offsets.append(np.asarray(batch_offsets, dtype=np.int64))
+        keys, offsets = _sorted_keys(keys, offsets)
+        np.save(f"{tmp_path}/keys.npy", keys)
+        np.save(f"{tmp_path}/offsets.npy", offsets)
+    print(f"> Indexed {len(keys)} lines of {path} in {time.time() - start:.1f}s: {index_path}")
+
+
+class TextIndex:
+    # lookups into an `id text` file through its memory mapped index, without loading the file
+
+    def __init__(self, path: str, index_path: str):
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(index_path)
+        self.keys = np.load(f"{index_path}/keys.npy", mmap_mode="r")
+        self.offsets = np.load(f"{index_path}/offsets.npy", mmap_mode="r")
+        self.f = open(path, "rb")
+        self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) > 0 else b""
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _line(self, offset: int) -> str:
+        end = self.data.find(b"\n", offset)
+        line = self.data[offset:end if end != -1 else len(self.data)].decode("utf-8").rstrip("\r")
+        return line.partition(" ")[2]
+
+    def get_all(self, _id: str) -> list[str]:
+        key = _id.encode("utf-8")
+        if len(key) > self.keys.dtype.itemsize:
+            return []
+        lo = int(np.searchsorted(self.keys, key, side="left"))
+        hi = int(np.searchsorted(self.keys, key, side="right"))
+        return [self._line(int(o)) for o in self.offsets[lo:hi]]
+
+    def get_many(self, keys, as_list: bool=False) -> dict:
+        # like prepare.load: every value of an id as a list, or the last one
+        values = {}
+        for _id in dict.fromkeys(keys):
+            found = self.get_all(_id)
+            if len(found) > 0:
+                values[_id] = found if as_list else found[-1]
+        return values
+
+
+def open_text_index(path: str, index_path: str=None) -> TextIndex:
+    if index_path is None:
+        index_path = f"{path}.idx"
+    if is_stale(index_path, path):
+        with build_lock(index_path):
+            # another process may have built it while this one was waiting
+            if is_stale(index_path, path):
+                build_text_index(path, index_path)
+    return TextIndex(path, index_path)
@@ -1,8 +1,15 @@
-import requests, time, argparse
-import networkx as nx
-import matplotlib.pyplot as plt
+import argparse, os, sys, time
 
 from itertools import permutations
+from multiprocessing import Pool
+from backends import Backend, SPARQLBackend, add_backend_arguments, backend_from_args, get_backend, strip_prefix
+from cache import add_cache_arguments, configure_cache_from_args
+from files import atomic_write
+from graph_stats import dump_stats, print_stats, store_stats
+from rdf_index import RDFIndex, open_rdf_index
+from sparql import AdaptiveBatcher, add_client_arguments, batcher_from_args, configure_from_args, first_bindings, get_client
+from triple_store import TripleStore
+from visualize import add_visualize_arguments, visualize_from_args
 
 
 def load_entities(path: str) -> list[str]:
@@ -11,10 +18,44 @@ def load_entities(path: str) -> list[str]:
     return ids
 
 
-def load_rdf_triplets(path: str) -> list[tuple]:
-    with open(path, "r") as f:
-        triplets = f.readlines()
-    return [tuple(t.replace("\n", "").split(" ")) for t in triplets]
+def shard_rdf_file(path: str, n_shards: int) -> list[tuple[int, int]]:
+    # split the file in byte ranges of similar size, aligned to the beginning of a line
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, n_shards):
+            f.seek(max(size * i // n_shards, bounds[-1]))
+            f.readline()
+            bounds.append(min(max(f.tell(), bounds[-1]), size))
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def stream_rdf_triplets(path: str, entities: set[str]=None, relations: set[str]=None, both_ends: bool=True, start: int=0, end: int=None):
+    # read the triplets line by line, filtering them on the fly, so that memory does not grow with the file size
+    with open(path, "rb") as f:
+        f.seek(start)
+        position = start
+        for line in f:
+            if end is not None and position >= end:
+                break
+            position += len(line)
+            triplet = line.decode("utf-8").split()
+            if len(triplet) != 3:
+                continue
+            head, rel, tail = triplet
+            if relations is not None and rel not in relations:
+                continue
+            if entities is not None:
+                if both_ends and not (head in entities and tail in entities):
+                    continue
+                if not both_ends and not (head in entities or tail in entities):
+                    continue
+            yield head, rel, tail
+
+
+def load_rdf_triplets(path: str, entities: set[str]=None, relations: set[str]=None) -> list[tuple]:
+    return list(stream_rdf_triplets(path, entities=entities, relations=relations))
 
 
 QUERY = """PREFIX wikibase: <http://wikiba.se/ontology#>
@@ -29,114 +70,266 @@ WHERE
 }}
 """
 
-SPARQL_ENDPOINT = "https://query.wikidata.org/bigdata/namespace/wdq/sparql" 
-
 
-def query_for_relations(heads: list[str], tails: list[str]) -> list[str]:
+def relations_query(heads: list[str], tails: list[str]) -> str:
     if len(heads) != len(tails):
-        raise RuntimeError
+        raise RuntimeError(f"heads and tails have different lengths: {len(heads)} and {len(tails)}")
     triplets = "\n  ".join([
         f"OPTIONAL {{ wd:{h} ?r{i} wd:{t}. }}"
         for i, (h,t) in enumerate(zip(heads, tails))
     ])
     r_vars = " ".join([f"?r{i}" for i in range(len(heads))])
-    query = QUERY.format(r_vars=r_vars, triplets=triplets)
-    status = None
-    while status != 200:
-        r = requests.get(
-            SPARQL_ENDPOINT,
-            params = {'format': 'json', 'query': query}
-        )
-        status = r.status_code
-        if status == 429:
-            print("> 429: too many requests.")
-            time.sleep(3)
-        elif status == 200:
-            bindings = r.json()["results"]["bindings"]
-            relations = []
-            if len(bindings) > 0:
-                bindings = bindings[0]
-                for i in range(len(heads)):
-                    if f"r{i}" in bindings:
-                        relations.append(bindings[f"r{i}"]["value"])
-                    else:
-                        relations.append(None)
-            else:
-                relations = [None for _ in range(len(heads))]    
-            time.sleep(0.5)
-            return relations
-        else:
-            print(f"> {status}: error.")
-            raise RuntimeError
-
-
-def construct_graph_from_entities(entities: set[str], query=False, batchsize: int=100) -> list[tuple]:
+    return QUERY.format(r_vars=r_vars, triplets=triplets)
+
+
+def parse_relations(response: dict, n: int) -> list[str]:
+    relations = first_bindings(response, [f"r{i}" for i in range(n)])
+    return [strip_prefix(r) if r is not None else None for r in relations]
+
+
+def query_for_relations(heads: list[str], tails: list[str]) -> list[str]:
+    response = get_client().query(relations_query(heads, tails))
+    return parse_relations(response, len(heads))
+
+
+def _query_pairs_for_relations(pairs: list[tuple]) -> list[str]:
+    heads, tails = zip(*pairs)
+    return query_for_relations(heads, tails)
+
+
+def construct_graph_from_entities(entities: set[str], query=False, batchsize: int=100, index: RDFIndex=None, rdf: str=None, store: TripleStore=None, strategy: str="out-edges", batcher: AdaptiveBatcher=None, backend: Backend=None, heads: list[str]=None, start: int=0, end: int=None) -> list[tuple]:
+    # heads restricts the graph to the edges leaving them, start and end to a byte range of the rdf file
     triplets = []
+    if not query and store is not None:
+        mask = store.edge_mask(entities)
+        if heads is not None:
+            mask &= store.entity_mask(heads)[store.heads]
+        return list(store.select(mask))
+    if not query and index is not None:
+        return index.subgraph(entities, heads)
     if not query:
-        global rdf_triplets
-        for head, rel, tail in rdf_triplets:
-            if head in entities and tail in entities:
-                triplets.append((head, rel, tail))
+        return list(stream_rdf_triplets(rdf, entities=entities, start=start, end=end))
+
+    batcher = AdaptiveBatcher(initial=batchsize) if batcher is None else batcher
+    backend = get_backend() if backend is None else backend
+    if strategy == "out-edges":
+        # one lookup per batch of heads, the tails are intersected with the entities locally
+        heads = [e for e in (entities if heads is None else heads) if e.startswith("Q")]
+        done = 0
+        for batch, edges in backend.map(backend.out_edges, heads, batcher):
+            triplets += [(h, r, t) for h, out_edges in zip(batch, edges) for r, t in out_edges if t in entities]
+            done += len(batch)
+            print(f"> Collecting outgoing edges. ({done}/{len(heads)})", end="\r")
+        print("\n")
+        batcher.report()
         return triplets
-            
-    head_tail_pairs = list(permutations(entities, 2))
-    for i in range(0, len(head_tail_pairs), batchsize):
-        heads, tails = list(zip(*head_tail_pairs[i:i + batchsize]))
-        relations = query_for_relations(heads, tails)
-        for h, r, t in zip(heads, relations, tails):
+    elif strategy != "pairwise":
+        raise RuntimeError(f"Unknown strategy: {strategy}, use `out-edges` or `pairwise`.")
+    elif not isinstance(backend, SPARQLBackend):
+        raise RuntimeError("The `pairwise` strategy needs the sparql backend.")
+
+    # probe every ordered pair of entities, only viable for very small sets
+    if heads is None:
+        head_tail_pairs = list(permutations(entities, 2))
+    else:
+        head_tail_pairs = [(h, t) for h in heads for t in entities if h != t]
+    done = 0
+    for pairs, relations in batcher.map(_query_pairs_for_relations, head_tail_pairs):
+        for (h, t), r in zip(pairs, relations):
             if r is not None:
                 triplets.append((h, r, t))
-        print(f"> Searching for relations in Wikidata. ({i}/{len(head_tail_pairs)})", end="\r")
+        done += len(pairs)
+        print(f"> Searching for relations in Wikidata. ({done}/{len(head_tail_pairs)})", end="\r")
     print("\n")
+    batcher.report()
     return triplets
             
 
 def dump_graph(triplets: list, path: str):
-    with open(path, "w") as f:
+    with atomic_write(path) as f:
         for t in triplets:
             f.write(" ".join(t) + "\n")
 
+
+def construct_edges_touching(added: set[str], entities: set[str], query=False, index: RDFIndex=None, rdf: str=None, store: TripleStore=None, strategy: str="out-edges", batcher: AdaptiveBatcher=None, backend: Backend=None) -> list[tuple]:
+    # the edges between the entities with at least one end among the added ones
+    if not query and store is not None:
+        added_mask, entities_mask = store.entity_mask(added), store.entity_mask(entities)
+        mask = (added_mask[store.heads] & entities_mask[store.tails]) | (entities_mask[store.heads] & added_mask[store.tails])
+        return list(store.select(mask))
+    if not query and index is not None:
+        return (
+            [t for t in index.out_edges(list(added)) if t[2] in entities]
+            + [t for t in index.in_edges(list(added)) if t[0] in entities and t[0] not in added]
+        )
+    if not query:
+        return [t for t in stream_rdf_triplets(rdf, entities=added, both_ends=False) if t[0] in entities and t[2] in entities]
+    kwargs = {"query": True, "strategy": strategy, "batcher": batcher, "backend": backend}
+    triplets = construct_graph_from_entities(entities, heads=sorted(added), **kwargs)
+    if strategy == "pairwise":
+        return triplets + construct_graph_from_entities(added, heads=sorted(entities - added), **kwargs)
+    # the edges from the previous entities towards the added ones, looked up between the two sets: the
+    # incoming edges of an added hub (e.g. Q5) would be millions of rows, more than a query can return
+    batcher = AdaptiveBatcher() if batcher is None else batcher
+    backend = get_backend() if backend is None else backend
+    previous = [e for e in sorted(entities - added) if e.startswith("Q")]
+    tails = [e for e in sorted(added) if e.startswith("Q")]
+    done = 0
+    for batch, edges in backend.map(lambda heads: backend.edges_between(heads, tails), previous, batcher):
+        triplets += [(h, r, t) for h, out_edges in zip(batch, edges) for r, t in out_edges]
+        done += len(batch)
+        print(f"> Collecting edges towards the added entities. ({done}/{len(previous)})", end="\r")
+    print("\n")
+    batcher.report()
+    return triplets
+
+
+def update_graph(previous: list[tuple], previous_entities: set[str], entities: set[str], new_edges) -> list[tuple]:
+    # the previous edges between the kept entities, plus the ones touching the added entities from new_edges(added)
+    added = entities - previous_entities
+    removed = previous_entities - entities
+    kept = [t for t in previous if t[0] in entities and t[2] in entities]
+    print(f"> Updating the graph: {len(added)} entities added, {len(removed)} removed, {len(previous) - len(kept)} triplets dropped")
+    return kept + (new_edges(added) if len(added) > 0 else [])
+
+
+def shard_entities(entities: set[str], shard: int, n_shards: int) -> list[str]:
+    # sorted, so that the independent processes of an array job agree on the slices
+    entities = sorted(entities)
+    return entities[len(entities) * shard // n_shards:len(entities) * (shard + 1) // n_shards]
+
+
+def graph_part(path: str, shard: int) -> str:
+    return f"{path}.part{shard}"
+
+
+def construct_graph_from_args(args, entities: set[str], shard: int=None, added: set[str]=None) -> list[tuple]:
+    # the whole graph, or only the part of `shard` out of `args.shards`: a byte range of the
+    # --rdf file when it is streamed, a slice of the heads otherwise, or with `added` only
+    # the edges touching the added entities
+    index, store, batcher, backend = None, None, None, None
+    heads, start, end = None, 0, None
+    if shard is not None:
+        heads = shard_entities(entities, shard, args.shards)
+    do_query = args.rdf is None
+    if do_query:
+        configure_from_args(args, workers=min(args.workers, args.shards) if shard is not None else 1)
+        configure_cache_from_args(args)
+        batcher = batcher_from_args(args, initial=100)
+        backend = backend_from_args(args)
+    if args.rdf is not None and os.path.isdir(args.rdf):
+        store = TripleStore.load(args.rdf)
+    elif args.rdf is not None and not args.no_index:
+        index = open_rdf_index(args.rdf, args.index)
+    elif args.rdf is not None and shard is not None:
+        heads = None
+        start, end = shard_rdf_file(args.rdf, args.shards)[shard]
+    if added is not None:
+        triplets = construct_edges_touching(added, entities, query=do_query, index=index, rdf=args.rdf, store=store, strategy=args.strategy, batcher=batcher, backend=backend)
+    else:
+        triplets = construct_graph_from_entities(entities, query=do_query, index=index, rdf=args.rdf, store=store, strategy=args.strategy, batcher=batcher, backend=backend, heads=heads, start=start, end=end)
+    if index is not None:
+        index.close()
+    if backend is not None:
+        backend.close()
+    return triplets
+
+
+def construct_graph_shard(task: tuple) -> tuple[int, int, float]:
+    args, entities, shard = task
+    start = time.time()
+    triplets = construct_graph_from_args(args, entities, shard)
+    dump_graph(triplets, graph_part(args.outfile, shard))
+    return shard, len(triplets), time.time() - start
+
+
+def construct_graph_sharded(args, entities: set[str]) -> dict:
+    # one process per shard, each writing its own part of the graph
+    # the clients are configured inside the workers, a forked event loop thread would be dead
+    timings = {}
+    if args.rdf is not None and not os.path.isdir(args.rdf) and not args.no_index:
+        # built once here rather than by every worker
+        open_rdf_index(args.rdf, args.index).close()
+    with Pool(args.workers) as p:
+        tasks = [(args, entities, shard) for shard in range(args.shards)]
+        for shard, n_triplets, elapsed in p.imap_unordered(construct_graph_shard, tasks):
+            timings[shard] = (n_triplets, elapsed)
+            print(f"> Shard {shard}: {n_triplets} triplets in {elapsed:.1f}s")
+    return timings
+
+
+def merge_graph_parts(path: str, n_shards: int, remove: bool=True) -> list[tuple]:
+    # concatenate the parts in shard order, dropping the triplets already seen
+    seen = set()
+    triplets = []
+    for shard in range(n_shards):
+        part = graph_part(path, shard)
+        for triplet in stream_rdf_triplets(part):
+            if triplet not in seen:
+                seen.add(triplet)
+                triplets.append(triplet)
+    dump_graph(triplets, path)
+    if remove:
+        for shard in range(n_shards):
+            os.remove(graph_part(path, shard))
+    print(f"> Merged {n_shards} parts, {len(triplets)} unique triplets: {path}")
+    return triplets
+
             
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--entities")
     parser.add_argument("--outfile", default="graph.txt")
-    parser.add_argument("--rdf")
-    parser.add_argument("--visualize", action="store_true")
+    parser.add_argument("--rdf", help="triplets file, or a directory holding a triple store (see triple_store.py)")
+    parser.add_argument("--index", help="on-disk head/tail index of the --rdf triplets, built on first use (default: <rdf>.idx)")
+    parser.add_argument("--no-index", action="store_true", help="stream the whole --rdf file instead of using the index")
+    parser.add_argument("--visualize", action="store_true", help="draw the largest components of the graph (see visualize.py)")
+    parser.add_argument("--stats", help="json file for the graph statistics (see graph_stats.py)")
+    parser.add_argument("--strategy", choices=("out-edges", "pairwise"), default="out-edges", help="query mode: batched outgoing edges of every entity, or one probe per ordered pair of entities (very small sets only)")
+    parser.add_argument("--workers", type=int, default=1, help="processes building the shards of the graph")
+    parser.add_argument("--shards", type=int, help="number of parts the graph is built in (default: --workers)")
+    parser.add_argument("--shard-id", type=int, help="only build this shard into <outfile>.part<id> and exit, e.g. a Slurm array task")
+    parser.add_argument("--merge", action="store_true", help="merge the --shards parts written by --shard-id runs into --outfile")
+    parser.add_argument("--previous-entities", help="update the graph built for these entities instead of building it from scratch")
+    parser.add_argument("--previous-graph", help="graph to update (default: --outfile)")
+    add_visualize_arguments(parser)
+    add_backend_arguments(parser)
+    add_client_arguments(parser)
+    add_cache_arguments(parser)
     args = parser.parse_args()
+    args.shards = args.workers if args.shards is None else args.shards
     
     entities = set(load_entities(args.entities))
-    if args.rdf is not None:
-        rdf_triplets = load_rdf_triplets(args.rdf)
-        do_query = False
+    if args.shard_id is not None:
+        shard, n_triplets, elapsed = construct_graph_shard((args, entities, args.shard_id))
+        print(f"> Shard {shard}/{args.shards}: {n_triplets} triplets in {elapsed:.1f}s: {graph_part(args.outfile, shard)}")
+        sys.exit()
+    if args.previous_entities is not None:
+        previous = list(stream_rdf_triplets(args.outfile if args.previous_graph is None else args.previous_graph))
+        triplets = update_graph(
+            previous,
+            set(load_entities(args.previous_entities)),
+            entities,
+            lambda added: construct_graph_from_args(args, entities, added=added)
+        )
+        dump_graph(triplets, args.outfile)
+    elif args.merge:
+        triplets = merge_graph_parts(args.outfile, args.shards)
+    elif args.shards > 1:
+        start = time.time()
+        timings = construct_graph_sharded(args, entities)
+        print(f"> {args.shards} shards built by {args.workers} workers in {time.time() - start:.1f}s (slowest shard {max(t for _, t in timings.values()):.1f}s)")
+        triplets = merge_graph_parts(args.outfile, args.shards)
     else:
-        rdf_triplets = None
-        do_query = True
-    triplets = construct_graph_from_entities(entities, query=do_query)
-
-    graph = nx.DiGraph()
-    graph.add_nodes_from(entities)
-    for head, rel, tail in triplets:
-        graph.add_edge(head, tail, type=rel)
-        
-    connected_components = nx.connected_components(graph.to_undirected())
-    n_connected_components = nx.number_connected_components(graph.to_undirected())
-    print(f"""
-    -------------- Graph --------------
-    
-    > Number of Nodes: {len(graph.nodes)}
-    > Number of Edges: {len(graph.edges)}
+        triplets = construct_graph_from_args(args, entities)
+        dump_graph(triplets, args.outfile)
+
+    # the entities are nodes even when they have no edge
+    graph = TripleStore.from_triplets(triplets, {e: i for i, e in enumerate(sorted(entities))})
+    stats = store_stats(graph)
+    print_stats(stats)
+    if args.stats is not None:
+        dump_stats(stats, args.stats)
 
-    > Number of connected Nodes: {n_connected_components}
-    > Top 100 connected clusters size: {[len(c) for c in sorted(connected_components, key=len, reverse=True)][:100]}
-    
-    -----------------------------------
-    """)
-        
     if args.visualize:
-        # visualize the graph
-        fig, ax = plt.subplots(figsize=(9, 9), facecolor='lightskyblue', layout='constrained')
-        nx.draw(graph, ax=ax)
-        plt.savefig("graph.pdf", format="pdf", dpi=300)
-        
-    dump_graph(triplets, args.outfile)
+        visualize_from_args(args, graph)
@@ -1,8 +1,27 @@
 #!/bin/bash
-#SBATCH -o wikidata_graph.log 
+#SBATCH -o wikidata_graph.log
 #SBATCH -p sim
 #SBATCH --nodes=1
 #SBATCH --ntasks=1
 #SBATCH --cpus-per-task=1
 
-python to_graph.py --entities $1 --outfile $2
+# single node: sbatch --cpus-per-task=8 to_graph.sh entities.txt graph.txt [to_graph.py options]
+#   one worker per allocated cpu, each building a shard of the graph
+# array job: sbatch --array=0-15 -o wikidata_graph_%a.log to_graph.sh entities.txt graph.txt [options]
+#   every task writes graph.txt.part<task>, then merge them once all tasks are done with
+#   sbatch --dependency=afterok:<array job id> to_graph.sh entities.txt graph.txt --merge --shards 16
+#   with --rdf, the tasks share the index of the triplets (<rdf>.idx): the first task builds it while the
+#   others wait on <rdf>.idx.lock, which needs flock support on a shared file system; to avoid holding
+#   the whole array on one task, build it once before submitting the array with
+#   python -c "from rdf_index import open_rdf_index; open_rdf_index('rdf_triplets.txt').close()"
+
+ents_file=$1
+outfile=$2
+shift 2
+
+if [ -n "$SLURM_ARRAY_TASK_ID" ]
+then
+	python to_graph.py --entities "$ents_file" --outfile "$outfile" --shards "$SLURM_ARRAY_TASK_COUNT" --shard-id $((SLURM_ARRAY_TASK_ID - SLURM_ARRAY_TASK_MIN)) "$@"
+else
+	python to_graph.py --entities "$ents_file" --outfile "$outfile" --workers "${SLURM_CPUS_PER_TASK:-1}" "$@"
+fi
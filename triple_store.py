@@ -0,0 +1,170 @@
+import argparse, json, os
+import numpy as np
+
+from array import array
+
+
+def _intern(_id: str, _dict: dict, _list: list) -> int:
+    idx = _dict.get(_id)
+    if idx is None:
+        idx = len(_list)
+        _dict[_id] = idx
+        _list.append(_id)
+    return idx
+
+
+class TripleStore:
+
+    def __init__(self, heads: np.ndarray, rels: np.ndarray, tails: np.ndarray, ent2idx: dict, rel2idx: dict, idx2ent: list=None, idx2rel: list=None):
+        if not len(heads) == len(rels) == len(tails):
+            raise RuntimeError(f"heads, relations and tails have different lengths: {len(heads)}, {len(rels)} and {len(tails)}")
+        self.heads = heads
+        self.rels = rels
+        self.tails = tails
+        self.ent2idx = ent2idx
+        self.rel2idx = rel2idx
+        # the inverse indices are sorted on first use, or shared with the store they were built from
+        self._idx2ent = idx2ent
+        self._idx2rel = idx2rel
+
+    @property
+    def idx2ent(self) -> list[str]:
+        if self._idx2ent is None:
+            self._idx2ent = sorted(self.ent2idx, key=self.ent2idx.get)
+        return self._idx2ent
+
+    @property
+    def idx2rel(self) -> list[str]:
+        if self._idx2rel is None:
+            self._idx2rel = sorted(self.rel2idx, key=self.rel2idx.get)
+        return self._idx2rel
+
+    @classmethod
+    def from_triplets(cls, triplets, ent2idx: dict=None, rel2idx: dict=None):
+        # ids already present in the given indices are kept, unseen ones are appended
+        ent2idx = dict(ent2idx) if ent2idx is not None else {}
+        rel2idx = dict(rel2idx) if rel2idx is not None else {}
+        idx2ent = sorted(ent2idx, key=ent2idx.get)
+        idx2rel = sorted(rel2idx, key=rel2idx.get)
+        heads, rels, tails = array("i"), array("i"), array("i")
+        for head, rel, tail in triplets:
+            heads.append(_intern(head, ent2idx, idx2ent))
+            rels.append(_intern(rel, rel2idx, idx2rel))
+            tails.append(_intern(tail, ent2idx, idx2ent))
+        return cls(
+            np.frombuffer(heads, dtype=np.int32),
+            np.frombuffer(rels, dtype=np.int32),
+            np.frombuffer(tails, dtype=np.int32),
+            ent2idx,
+            rel2idx,
+            idx2ent,
+            idx2rel
+        )
+
+    @classmethod
+    def from_graph_file(cls, path: str, ent2idx: dict=None, rel2idx: dict=None):
+        with open(path, "r") as f:
+            return cls.from_triplets(
+                (t for t in map(str.split, f) if len(t) == 3),
+                ent2idx,
+                rel2idx
+            )
+
+    def to_graph_file(self, path: str, batchsize: int=1000000):
+        with open(path, "w") as f:
+            for i in range(0, len(self), batchsize):
+                f.writelines(
+                    f"{self.idx2ent[h]} {self.idx2rel[r]} {self.idx2ent[t]}\n"
+                    for h, r, t in zip(
+                        self.heads[i:i + batchsize].tolist(),
+                        self.rels[i:i + batchsize].tolist(),
+                        self.tails[i:i + batchsize].tolist()
+                    )
+                )
+
+    def save(self, dirname: str):
+        os.makedirs(dirname, exist_ok=True)
+        for name in ("heads", "rels", "tails"):
+            np.save(f"{dirname}/{name}.npy", np.ascontiguousarray(getattr(self, name), dtype=np.int32))
+        with open(f"{dirname}/ent2idx.json", "w") as f:
+            json.dump(self.ent2idx, f)
+        with open(f"{dirname}/rel2idx.json", "w") as f:
+            json.dump(self.rel2idx, f)
+
+    @classmethod
+    def load(cls, dirname: str, mmap: bool=True):
+        mmap_mode = "r" if mmap else None
+        heads, rels, tails = [
+            np.load(f"{dirname}/{name}.npy", mmap_mode=mmap_mode)
+            for name in ("heads", "rels", "tails")
+        ]
+        with open(f"{dirname}/ent2idx.json", "r") as f:
+            ent2idx = json.load(f)
+        with open(f"{dirname}/rel2idx.json", "r") as f:
+            rel2idx = json.load(f)
+        return cls(heads, rels, tails, ent2idx, rel2idx)
+
+    def __len__(self) -> int:
+        return len(self.heads)
+
+    def __iter__(self):
+        for h, r, t in zip(self.heads.tolist(), self.rels.tolist(), self.tails.tolist()):
+            yield self.idx2ent[h], self.idx2rel[r], self.idx2ent[t]
+
+    @property
+    def n_entities(self) -> int:
+        return len(self.ent2idx)
+
+    def entity_mask(self, entities) -> np.ndarray:
+        mask = np.zeros(self.n_entities, dtype=bool)
+        ids = [self.ent2idx[e] for e in entities if e in self.ent2idx]
+        mask[np.asarray(ids, dtype=np.int64)] = True
+        return mask
+
+    def edge_mask(self, entities=None, relations=None, both_ends: bool=True) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        if entities is not None:
+            ent_mask = self.entity_mask(entities)
+            if both_ends:
+                mask &= ent_mask[self.heads] & ent_mask[self.tails]
+            else:
+                mask &= ent_mask[self.heads] | ent_mask[self.tails]
+        if relations is not None:
+            rel_mask = np.zeros(len(self.rel2idx), dtype=bool)
+            ids = [self.rel2idx[r] for r in relations if r in self.rel2idx]
+            rel_mask[np.asarray(ids, dtype=np.int64)] = True
+            mask &= rel_mask[self.rels]
+        return mask
+
+    def select(self, mask: np.ndarray):
+        # the selected store shares the entity and relation indices of this one
+        return TripleStore(self.heads[mask], self.rels[mask], self.tails[mask], self.ent2idx, self.rel2idx, self._idx2ent, self._idx2rel)
+
+    def filter(self, entities=None, relations=None, both_ends: bool=True):
+        return self.select(self.edge_mask(entities, relations, both_ends))
+
+
+def load_index(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--graph", help="space separated `head rel tail` triplets file")
+    parser.add_argument("--store", help="triple store directory")
+    parser.add_argument("--ent2idx")
+    parser.add_argument("--rel2idx")
+    parser.add_argument("--export", action="store_true", help="write the --store back to the --graph file")
+    args = parser.parse_args()
+
+    if args.export:
+        store = TripleStore.load(args.store)
+        store.to_graph_file(args.graph)
+        print(f"> Exported {len(store)} triplets to {args.graph}")
+    else:
+        ent2idx = load_index(args.ent2idx) if args.ent2idx is not None else None
+        rel2idx = load_index(args.rel2idx) if args.rel2idx is not None else None
+        store = TripleStore.from_graph_file(args.graph, ent2idx, rel2idx)
+        store.save(args.store)
+        print(f"> Stored {len(store)} triplets, {store.n_entities} entities and {len(store.rel2idx)} relations under {args.store}")
@@ -0,0 +1,166 @@
+import argparse, json, os, time
+import numpy as np
+import networkx as nx
+import matplotlib.pyplot as plt
+
+from matplotlib.collections import LineCollection
+
+from files import atomic_write
+from graph_stats import connected_components
+from triple_store import TripleStore
+
+
+LAYOUTS = ("forceatlas2", "spring", "spectral")
+
+
+def select_nodes(store: TripleStore, n_components: int=10, max_nodes: int=1000, sample: str="degree", seed: int=0) -> np.ndarray:
+    # the nodes of the largest components, cut down to max_nodes keeping the highest degree or random ones
+    roots = connected_components(store.n_entities, store.heads, store.tails)
+    sizes = np.bincount(roots, minlength=store.n_entities)
+    top = np.argsort(-sizes, kind="stable")[:n_components]
+    nodes = np.flatnonzero(np.isin(roots, top[sizes[top] > 0]))
+    if len(nodes) > max_nodes:
+        if sample == "degree":
+            degrees = np.bincount(store.heads, minlength=store.n_entities) + np.bincount(store.tails, minlength=store.n_entities)
+            nodes = nodes[np.argsort(-degrees[nodes], kind="stable")[:max_nodes]]
+        elif sample == "random":
+            nodes = np.random.default_rng(seed).choice(nodes, max_nodes, replace=False)
+        else:
+            raise RuntimeError(f"Unknown sampling: {sample}, use `degree` or `random`.")
+    return np.sort(nodes)
+
+
+def induced_edges(store: TripleStore, nodes: np.ndarray, max_edges: int=20000, seed: int=0) -> tuple[np.ndarray, np.ndarray]:
+    # distinct (head, tail) pairs between the nodes, without self loops, at most max_edges of them
+    mask = np.zeros(store.n_entities, dtype=bool)
+    mask[nodes] = True
+    heads = np.asarray(store.heads, dtype=np.int64)
+    tails = np.asarray(store.tails, dtype=np.int64)
+    keep = mask[heads] & mask[tails] & (heads != tails)
+    pairs = np.unique(heads[keep] * store.n_entities + tails[keep])
+    if len(pairs) > max_edges:
+        pairs = np.random.default_rng(seed).choice(pairs, max_edges, replace=False)
+    return pairs // store.n_entities, pairs % store.n_entities
+
+
+def load_layout(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_layout(pos: dict, path: str):
+    with atomic_write(path) as f:
+        json.dump(pos, f)
+
+
+def compute_layout(graph: nx.Graph, layout: str="forceatlas2", cache: str=None, iterations: int=100, seed: int=0) -> dict:
+    # positions found in the cache are reused, so that only the new nodes are placed (or nothing at all)
+    cached = load_layout(cache) if cache is not None else {}
+    missing = [n for n in graph if n not in cached]
+    if len(missing) == 0:
+        return {n: cached[n] for n in graph}
+    rng = np.random.default_rng(seed)
+    known = [n for n in graph if n in cached]
+    init = {n: np.asarray(cached[n]) if n in cached else rng.uniform(-1, 1, 2) for n in graph}
+    if layout == "spectral":
+        # sparse eigenvectors of the laplacian, scales to large graphs
+        pos = nx.spectral_layout(graph)
+    elif layout == "spring":
+        pos = nx.spring_layout(graph, pos=init, fixed=known if len(known) > 0 else None, iterations=iterations, seed=seed)
+    elif layout == "forceatlas2":
+        pos = nx.forceatlas2_layout(graph, pos=init, max_iter=iterations, seed=seed)
+    else:
+        raise RuntimeError(f"Unknown layout: {layout}, use one of {LAYOUTS}.")
+    pos = {n: [float(x) for x in p] for n, p in pos.items()}
+    if cache is not None:
+        save_layout({**cached, **pos}, cache)
+    return pos
+
+
+def render(pos: dict, edges: list[tuple], path: str, dpi: int=150, rasterized: bool=True, node_size: float=2.):
+    # a single collection for all the edges and one for all the nodes, rasterized in vector formats
+    # so that the file size does not grow with the number of elements
+    ids = list(pos)
+    xy = np.asarray([pos[n] for n in ids], dtype=float).reshape(-1, 2)
+    fig, ax = plt.subplots(figsize=(9, 9), facecolor='lightskyblue', layout='constrained')
+    if len(edges) > 0:
+        index = {n: i for i, n in enumerate(ids)}
+        segments = xy[np.asarray([(index[h], index[t]) for h, t in edges])]
+        ax.add_collection(LineCollection(segments, colors="black", linewidths=0.2, alpha=0.4, rasterized=rasterized))
+    ax.scatter(xy[:, 0], xy[:, 1], s=node_size, c="darkblue", linewidths=0, rasterized=rasterized)
+    ax.set_axis_off()
+    ax.autoscale()
+    fmt = os.path.splitext(path)[1][1:].lower() or "png"
+    plt.savefig(path, format=fmt, dpi=dpi, facecolor=fig.get_facecolor())
+    plt.close(fig)
+
+
+def visualize(store: TripleStore, path: str="graph.pdf", n_components: int=10, max_nodes: int=1000, max_edges: int=20000, sample: str="degree", layout: str="forceatlas2", layout_cache: str=None, iterations: int=100, dpi: int=150, seed: int=0) -> dict:
+    start = time.time()
+    nodes = select_nodes(store, n_components, max_nodes, sample, seed)
+    heads, tails = induced_edges(store, nodes, max_edges, seed)
+    ids = [store.idx2ent[n] for n in nodes.tolist()]
+    edges = [(store.idx2ent[h], store.idx2ent[t]) for h, t in zip(heads.tolist(), tails.tolist())]
+    graph = nx.Graph()
+    graph.add_nodes_from(ids)
+    graph.add_edges_from(edges)
+    layout_start = time.time()
+    pos = compute_layout(graph, layout, layout_cache, iterations, seed)
+    render_start = time.time()
+    render(pos, edges, path, dpi)
+    report = {
+        "nodes": len(ids),
+        "edges": len(edges),
+        "select_seconds": layout_start - start,
+        "layout_seconds": render_start - layout_start,
+        "render_seconds": time.time() - render_start,
+        "bytes": os.path.getsize(path),
+    }
+    print(
+        f"> Drew {report['nodes']} nodes and {report['edges']} edges of the {n_components} largest components: {path} ({report['bytes'] / 1024:.0f} KB) | "
+        f"select {report['select_seconds']:.1f}s, layout {report['layout_seconds']:.1f}s, render {report['render_seconds']:.1f}s"
+    )
+    return report
+
+
+def add_visualize_arguments(parser):
+    parser.add_argument("--viz-outfile", default="graph.pdf", help="pdf, svg or png, after the extension")
+    parser.add_argument("--viz-components", type=int, default=10, help="draw the largest components only")
+    parser.add_argument("--viz-max-nodes", type=int, default=1000)
+    parser.add_argument("--viz-max-edges", type=int, default=20000)
+    parser.add_argument("--viz-sample", choices=("degree", "random"), default="degree", help="nodes kept when the components exceed --viz-max-nodes")
+    parser.add_argument("--viz-layout", choices=LAYOUTS, default="forceatlas2")
+    parser.add_argument("--viz-layout-cache", help="json file of node positions, reused and extended across runs")
+    parser.add_argument("--viz-iterations", type=int, default=100)
+    parser.add_argument("--viz-dpi", type=int, default=150)
+    parser.add_argument("--viz-seed", type=int, default=0)
+
+
+def visualize_from_args(args, store: TripleStore) -> dict:
+    return visualize(
+        store,
+        args.viz_outfile,
+        n_components=args.viz_components,
+        max_nodes=args.viz_max_nodes,
+        max_edges=args.viz_max_edges,
+        sample=args.viz_sample,
+        layout=args.viz_layout,
+        layout_cache=args.viz_layout_cache,
+        iterations=args.viz_iterations,
+        dpi=args.viz_dpi,
+        seed=args.viz_seed
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--graph", help="space separated `head rel tail` triplets file")
+    parser.add_argument("--store", help="triple store directory (see triple_store.py), instead of --graph")
+    add_visualize_arguments(parser)
+    args = parser.parse_args()
+
+    store = TripleStore.load(args.store) if args.store is not None else TripleStore.from_graph_file(args.graph)
+    visualize_from_args(args, store)
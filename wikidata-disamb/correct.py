@@ -1,15 +1,23 @@
-import sys, json, random, warnings, re
+import argparse, sys, json, warnings, re
+import numpy as np
 
 from transformers import AutoTokenizer
 sys.path.append("../")
 
 from get_descriptions_and_labels import load_entities, dump
+from to_graph import stream_rdf_triplets
 
+from formats import add_format_arguments, write_records
+from multiprocessing import Pool
 from pathlib import Path
 from prepare import load
+from sampling import NegativeSampler
 from tqdm import tqdm
 
 
+TOKENIZER = "gpt2"
+
+
 def replace_redirected_entities(data: dict | set | list):
     global redirections
     data_copy = data.copy()
@@ -29,13 +37,13 @@ def replace_redirected_entities(data: dict | set | list):
     return data_copy
 
 
-def update_dataset(data, fix_label=False):
-    global non_existing_entities, corrected_ents
-    
+def update_dataset(data, fix_label=False, batch_size=1000, workers=1):
+    global non_existing_entities, sampler
+
+    if fix_label:
+        data = fix_string_labels(data, batch_size, workers)
     new_data = []
     for i, sample in tqdm(enumerate(data), total=len(data)):
-        if fix_label:
-            sample = fix_string_label(sample)
         ids = [sample["correct_id"], sample["wrong_id"]]
         if ids[0] in non_existing_entities:
             continue
@@ -43,54 +51,96 @@ def update_dataset(data, fix_label=False):
         if len(new_ids) < 2:
             # the correct id and wrong id were redirected to the same entity id
             # put as wrong id another random one
-            new_ids.append(
-                random.choice(
-                    list(set(corrected_ents) - {new_ids[0]})
-                )
-            )
+            new_ids.append(sampler.sample(exclude=new_ids[0], like=new_ids[0]))
         if ids[1] in non_existing_entities:
-            new_ids[1] = random.choice(
-                list(set(corrected_ents) - {new_ids[0]})
-            )
+            new_ids[1] = sampler.sample(exclude=new_ids[0], like=new_ids[0])
         sample["correct_id"] = new_ids[0]
         sample["wrong_id"] = new_ids[1]
         new_data.append(sample)
     return new_data
 
 
-def find_entity_span(entity_mention, entity, allow_recursion=True):
-    global tokenizer
+def desinences(ent: str) -> tuple[str]:
+    # some labels don't precisely coincide with the words in the text,
+    # they miss the final s, n or ed for instance
+    return ("s", "n", f"{ent[-1]}ed", "ic", "en", "es", "ns", "er", "ation", "ing", "ed", f"{ent[-1]}ing", "al", "\"", "ern", "h", "e", "te", "ian", "tic", "an", "rs", "nese", "lary", "vian", "ans")
 
-    l = entity.shape[-1]
-    i = 0
-    ent = tokenizer.decode(entity.ravel())
-    while i + l <= entity_mention.shape[-1]:
-        if all(entity_mention[0][i:i+l] == entity[0]):
-            return (i, i+l), ent
-        i += 1
-    # try with a space in front
-    if ent[0] != " " and allow_recursion:
-        ent = tokenizer(f" {ent.lower()}", add_special_tokens=False, return_tensors="pt").input_ids
-        return find_entity_span(entity_mention, ent)
-    # some labels don't precisely coincide with the words in the text
-    else:
-        # they miss the final s, n or ed for instance
-        desinences = ("s", "n", f"{ent[-1]}ed", "ic", "en", "es", "ns", "er", "ation", "ing", "ed", f"{ent[-1]}ing", "al", "\"", "ern", "h", "e", "te", "ian", "tic", "an", "rs", "nese", "lary", "vian", "ans")
-        for desinence in desinences:
-            if ent[-1] != desinence and allow_recursion:
-                span = find_entity_span(
-                    entity_mention,
-                    tokenizer(f"{ent}{desinence}", add_special_tokens=False, return_tensors="pt").input_ids,
-                    False
-                )
-                if span is not None:
-                    return span, f"{ent}{desinence}"
 
+def first_match(mention: np.ndarray, candidates: list[np.ndarray]) -> tuple[int, int]:
+    # (index, start) of the first of the candidates found in the mention, (-1, -1) if none is: every window
+    # of the mention is compared with all the candidates of the same length at once
+    best = (len(candidates), -1)
+    by_length = {}
+    for c, ids in enumerate(candidates):
+        by_length.setdefault(len(ids), []).append(c)
+    for l, indices in by_length.items():
+        if l > len(mention) or indices[0] > best[0]:
+            continue
+        if l == 0:
+            best = min(best, (indices[0], 0))
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(mention, l)
+        matches = (windows[None] == np.stack([candidates[c] for c in indices])[:, None]).all(-1)
+        found = matches.any(-1)
+        if found.any():
+            k = int(found.argmax())
+            best = min(best, (indices[k], int(matches[k].argmax())))
+    return best if best[1] != -1 else (-1, -1)
 
-def fix_string_label(sample):
+
+def tokenize(texts: list[str]) -> list[np.ndarray]:
+    # a single call to the fast tokenizer for the whole batch, no tensors
     global tokenizer
-    entity = sample["string"]
-    entity_mention = sample["text"]
+    if len(texts) == 0:
+        return []
+    return [np.asarray(ids, dtype=np.int64) for ids in tokenizer(texts, add_special_tokens=False).input_ids]
+
+
+def entity_candidates(entities: list[np.ndarray], allow_recursion: bool=True) -> tuple[list[list[np.ndarray]], list[list[str]]]:
+    # token ids and labels of every entity as it is and with a space in front, in the order they are tried
+    global tokenizer
+    decoded = tokenizer.batch_decode(entities)
+    candidates, labels = [[entity] for entity in entities], [[ent] for ent in decoded]
+    if allow_recursion:
+        spaced = [i for i, ent in enumerate(decoded) if ent[0] != " "]
+        for i, entity in zip(spaced, tokenize([f" {decoded[i].lower()}" for i in spaced])):
+            candidates[i].append(entity)
+        for i, ent in zip(spaced, tokenizer.batch_decode([candidates[i][-1] for i in spaced])):
+            labels[i].append(ent)
+    return candidates, labels
+
+
+def suffixed_candidates(ents: list[str]) -> tuple[list[list[np.ndarray]], list[list[str]]]:
+    # token ids and labels of every desinence variant of every label, tokenized in a single call
+    labels = [[f"{ent}{desinence}" for desinence in desinences(ent) if ent[-1] != desinence] for ent in ents]
+    flat = iter(tokenize([label for variants in labels for label in variants]))
+    return [[next(flat) for _ in variants] for variants in labels], labels
+
+
+def find_entity_spans(entity_mentions: list, entities: list, allow_recursion: bool=True) -> list[tuple[tuple[int, int], str] | None]:
+    # span of the first candidate label found in each mention and the label itself, None if none is found:
+    # the entity as it is, with a space in front, then all the desinence variants of the latter for the
+    # mentions still unmatched, each step tokenized in one batch
+    entity_mentions = [np.asarray(m, dtype=np.int64).ravel() for m in entity_mentions]
+    candidates, labels = entity_candidates([np.asarray(e, dtype=np.int64).ravel() for e in entities], allow_recursion)
+    matches = [first_match(m, c) for m, c in zip(entity_mentions, candidates)]
+    if allow_recursion:
+        unmatched = [i for i, (c, _) in enumerate(matches) if c == -1]
+        suffixed, suffixed_labels = suffixed_candidates([labels[i][-1] for i in unmatched])
+        for i, c, l in zip(unmatched, suffixed, suffixed_labels):
+            candidates[i], labels[i] = c, l
+            matches[i] = first_match(entity_mentions[i], c)
+    return [
+        ((start, start + len(candidates[i][c])), labels[i][c]) if c != -1 else None
+        for i, (c, start) in enumerate(matches)
+    ]
+
+
+def find_entity_span(entity_mention, entity, allow_recursion=True):
+    return find_entity_spans([entity_mention], [entity], allow_recursion)[0]
+
+
+def normalize_mention(entity_mention: str) -> str:
     # edit the sentence to help the tokenizer
     # insert white space between contiguos punctuation: ., -> . ,
     entity_mention = re.sub("(?<=[.,:;])(?=[.,:;])", r"\g<0> ", entity_mention.lower())
@@ -98,18 +148,62 @@ def fix_string_label(sample):
     entity_mention = re.sub("(?<=[\s\(][\"])[^\"]+(?=[\"][\s\)])", r" \g<0> ", entity_mention)
     if entity_mention[0] != " ":
         entity_mention = f" {entity_mention}"
-    tokenized_mention = tokenizer(entity_mention, add_special_tokens=False, return_tensors="pt")
-    tokenized_entity = tokenizer(entity.lower(), add_special_tokens=False, return_tensors="pt")
-    span, updated_label = find_entity_span(tokenized_mention.input_ids, tokenized_entity.input_ids)
-    sample["string"] = updated_label
+    return entity_mention
+
+
+def fix_labels(samples: list[tuple[str, str]]) -> list[str]:
+    # corrected label of every (string, text) pair, mentions and labels are tokenized in one batch each
+    mentions = tokenize([normalize_mention(text) for _, text in samples])
+    entities = tokenize([entity.lower() for entity, _ in samples])
+    labels = []
+    for found in find_entity_spans(mentions, entities):
+        span, updated_label = found
+        labels.append(updated_label)
+    return labels
+
+
+def fix_string_label(sample):
+    sample["string"] = fix_labels([(sample["string"], sample["text"])])[0]
     return sample
-    
+
+
+def init_worker(tokenizer_name: str):
+    global tokenizer
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+
+def fix_string_labels(data: list[dict], batch_size: int=1000, workers: int=1, tokenizer_name: str=TOKENIZER):
+    # fix_string_label over the whole dataset, in batches spread over a pool of processes each loading
+    # its own tokenizer, the samples are updated in place and in order
+    batches = [
+        [(sample["string"], sample["text"]) for sample in data[i:i + batch_size]]
+        for i in range(0, len(data), batch_size)
+    ]
+    if workers > 1:
+        with Pool(workers, initializer=init_worker, initargs=(tokenizer_name,)) as pool:
+            labels = list(tqdm(pool.imap(fix_labels, batches), total=len(batches)))
+    else:
+        labels = [fix_labels(batch) for batch in tqdm(batches)]
+    for sample, label in zip(data, (l for batch in labels for l in batch)):
+        sample["string"] = label
+    return data
+
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="processes fixing the labels of the test set")
+    parser.add_argument("--batch-size", type=int, default=1000, help="samples tokenized at once when fixing the labels")
+    add_format_arguments(parser)
+    parser.add_argument("--seed", type=int, help="seed of the wrong ids drawn to replace the missing ones")
+    parser.add_argument("--negatives-graph", help="graph file to draw the wrong ids by degree or type, uniformly without it")
+    parser.add_argument("--negatives-weighting", choices=("uniform", "degree"), default="uniform")
+    parser.add_argument("--negatives-type-relation", help="draw the wrong ids among the entities with the same type, e.g. P31")
+    args = parser.parse_args()
+
     Path("./corrected/").mkdir(parents=True, exist_ok=True)
 
-    tokenizer = AutoTokenizer.from_pretrained("gpt2")
+    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER)
     
     # load the dataset
     dataset = {}
@@ -153,13 +247,17 @@ if __name__ == "__main__":
         corrected_desc.pop(entity)
 
     # --> find a way to deal with missing descriptions or meaningless "Wikimedia disambiguation page" descriptions
+    if args.negatives_graph is not None:
+        sampler = NegativeSampler.from_graph(corrected_ents, stream_rdf_triplets(args.negatives_graph), args.negatives_weighting, args.negatives_type_relation, args.seed)
+    else:
+        sampler = NegativeSampler(corrected_ents, seed=args.seed)
+
     dump("corrected/entity_ids.txt", corrected_ents)
     dump("corrected/labels.txt", *zip(*corrected_labels.items()))
     dump("corrected/descriptions.txt", *zip(*corrected_desc.items()))    
     
     for _set in ("train", "dev", "test"):
         print(f"> Correcting {_set} set...")
-        with open(f"corrected/wikidata-disambig-{_set}.json", "w") as f:
-            fix_label = True if _set == "test" else False
-            json.dump(update_dataset(dataset[_set], fix_label), f, indent=2)
+        fix_label = True if _set == "test" else False
+        write_records(update_dataset(dataset[_set], fix_label, args.batch_size, args.workers), f"corrected/wikidata-disambig-{_set}", args.format, args.compression)
     print(f"> Generated corrected dataset under `./corrected/`.")
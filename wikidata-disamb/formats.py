@@ -0,0 +1,196 @@
+import json, os
+import numpy as np
+
+from files import atomic_path, atomic_write
+from to_graph import dump_graph
+from triple_store import TripleStore
+
+
+# json: the indented files read by the current loaders
+# npy: a directory per table, every column as .npy arrays that are memory mapped when read (zero copy)
+# parquet: one file per table, requires pyarrow, compressed with zstd by default
+FORMATS = ("json", "npy", "parquet")
+
+EXTENSIONS = {"json": ".json", "npy": "", "parquet": ".parquet"}
+
+
+class StringTable:
+    # strings stored as their concatenated utf-8 bytes and the offsets of their ends (like arrow string
+    # arrays), with a validity mask for the missing values; only the accessed strings are decoded
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, valid: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+        self.valid = valid
+
+    @classmethod
+    def from_strings(cls, strings: list[str]):
+        encoded = [s.encode("utf-8") if s is not None else b"" for s in strings]
+        offsets = np.cumsum([0] + [len(s) for s in encoded], dtype=np.int64)
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets, np.asarray([s is not None for s in strings], dtype=bool))
+
+    def save(self, prefix: str):
+        np.save(f"{prefix}.data.npy", self.data)
+        np.save(f"{prefix}.offsets.npy", self.offsets)
+        np.save(f"{prefix}.valid.npy", self.valid)
+
+    @classmethod
+    def load(cls, prefix: str, mmap: bool=True):
+        mmap_mode = "r" if mmap else None
+        return cls(*(np.load(f"{prefix}.{name}.npy", mmap_mode=mmap_mode) for name in ("data", "offsets", "valid")))
+
+    def __len__(self) -> int:
+        return len(self.valid)
+
+    def __getitem__(self, i: int) -> str:
+        if not self.valid[i]:
+            return None
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self) -> list[str]:
+        # a single copy of the bytes for the whole column instead of one per string
+        data, offsets = self.data.tobytes(), self.offsets.tolist()
+        return [
+            data[offsets[i]:offsets[i + 1]].decode("utf-8") if valid else None
+            for i, valid in enumerate(self.valid.tolist())
+        ]
+
+
+def _columns(records: list[dict] | dict) -> tuple[dict, list[str]]:
+    # the union of the keys of the records, in order of appearance, and the optional ones (missing from
+    # some records), whose None values are dropped when reading; records keyed by id (the pretraining sets)
+    # are stored as their values
+    if isinstance(records, dict):
+        records = list(records.values())
+    names = list(dict.fromkeys(k for record in records for k in record))
+    columns = {name: [record.get(name) for record in records] for name in names}
+    for name, values in columns.items():
+        if not all(v is None or isinstance(v, str) for v in values):
+            raise RuntimeError(f"Column {name} holds values other than strings.")
+    optional = [name for name in names if not all(name in record for record in records)]
+    return columns, optional
+
+
+def _parquet():
+    try:
+        import pyarrow, pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("The parquet format requires pyarrow: pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+
+def write_records(records: list[dict] | dict, path: str, fmt: str="json", compression: str="zstd") -> str:
+    # flat records with string values (the disambiguation samples, the pretraining captions), path is
+    # given without extension; returns the path written
+    if fmt == "json":
+        with atomic_write(f"{path}.json") as f:
+            json.dump(records, f, indent=2)
+    elif fmt == "npy":
+        columns, optional = _columns(records)
+        with atomic_path(path) as tmp_path:
+            os.makedirs(tmp_path)
+            for name, values in columns.items():
+                StringTable.from_strings(values).save(f"{tmp_path}/{name}")
+            with open(f"{tmp_path}/columns.json", "w") as f:
+                json.dump({"columns": list(columns), "optional": optional}, f)
+    elif fmt == "parquet":
+        pa, pq = _parquet()
+        columns, optional = _columns(records)
+        table = pa.table(columns).replace_schema_metadata({"optional": json.dumps(optional)})
+        with atomic_path(f"{path}.parquet") as tmp_path:
+            pq.write_table(table, tmp_path, compression=compression)
+    else:
+        raise RuntimeError(f"Unknown format: {fmt}, use one of {FORMATS}.")
+    return f"{path}{EXTENSIONS[fmt]}"
+
+
+def read_columns(path: str, fmt: str="npy") -> tuple[dict, list[str]]:
+    # column name -> values, memory mapped StringTables for npy, without building the records
+    if fmt == "npy":
+        with open(f"{path}/columns.json", "r") as f:
+            meta = json.load(f)
+        return {name: StringTable.load(f"{path}/{name}") for name in meta["columns"]}, meta["optional"]
+    if fmt == "parquet":
+        _, pq = _parquet()
+        table = pq.read_table(f"{path}.parquet", memory_map=True)
+        return table.to_pydict(), json.loads((table.schema.metadata or {}).get(b"optional", b"[]"))
+    if fmt == "json":
+        return _columns(read_records(path, fmt))
+    raise RuntimeError(f"Unknown format: {fmt}, use one of {FORMATS}.")
+
+
+def read_records(path: str, fmt: str="json") -> list[dict]:
+    if fmt == "json":
+        with open(f"{path}.json", "r") as f:
+            records = json.load(f)
+        return list(records.values()) if isinstance(records, dict) else records
+    columns, optional = read_columns(path, fmt)
+    optional = set(optional)
+    names = list(columns)
+    records = []
+    for values in zip(*(list(column) for column in columns.values())):
+        records.append({k: v for k, v in zip(names, values) if v is not None or k not in optional})
+    return records
+
+
+def write_index(index: dict, path: str, fmt: str="json", compression: str="zstd") -> str:
+    # id -> idx mapping (ent2idx, rel2idx) with contiguous indices, stored as the ids in index order
+    if fmt == "json":
+        with atomic_write(f"{path}.json") as f:
+            json.dump(index, f, indent=2)
+        return f"{path}.json"
+    ids = sorted(index, key=index.get)
+    if [index[_id] for _id in ids] != list(range(len(ids))):
+        raise RuntimeError(f"The indices of {path} are not contiguous.")
+    return write_records([{"id": _id} for _id in ids], path, fmt, compression)
+
+
+def read_index(path: str, fmt: str="json") -> dict:
+    if fmt == "json":
+        with open(f"{path}.json", "r") as f:
+            return json.load(f)
+    return {_id: i for i, _id in enumerate(read_columns(path, fmt)[0]["id"])}
+
+
+def write_triplets(triplets: list[tuple], ent2idx: dict, rel2idx: dict, path: str, fmt: str="json", compression: str="zstd") -> str:
+    # link prediction triplets as int32 head, rel and tail columns following ent2idx and rel2idx;
+    # the json format keeps the `head rel tail` text file
+    if fmt == "json":
+        dump_graph(triplets, f"{path}.txt")
+        return f"{path}.txt"
+    store = TripleStore.from_triplets(triplets, ent2idx, rel2idx)
+    if store.n_entities != len(ent2idx) or len(store.rel2idx) != len(rel2idx):
+        raise RuntimeError(f"The triplets of {path} hold entities or relations missing from the indices.")
+    columns = {name: np.ascontiguousarray(getattr(store, name), dtype=np.int32) for name in ("heads", "rels", "tails")}
+    if fmt == "npy":
+        with atomic_path(path) as tmp_path:
+            os.makedirs(tmp_path)
+            for name, values in columns.items():
+                np.save(f"{tmp_path}/{name}.npy", values)
+    elif fmt == "parquet":
+        pa, pq = _parquet()
+        with atomic_path(f"{path}.parquet") as tmp_path:
+            pq.write_table(pa.table(columns), tmp_path, compression=compression)
+    else:
+        raise RuntimeError(f"Unknown format: {fmt}, use one of {FORMATS}.")
+    return f"{path}{EXTENSIONS[fmt]}"
+
+
+def read_triplets(path: str, fmt: str="npy", mmap: bool=True) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if fmt == "npy":
+        mmap_mode = "r" if mmap else None
+        return tuple(np.load(f"{path}/{name}.npy", mmap_mode=mmap_mode) for name in ("heads", "rels", "tails"))
+    if fmt == "parquet":
+        _, pq = _parquet()
+        table = pq.read_table(f"{path}.parquet", memory_map=True)
+        return tuple(table.column(name).to_numpy() for name in ("heads", "rels", "tails"))
+    raise RuntimeError(f"Unknown format: {fmt}, the json format stores `head rel tail` text, see to_graph.stream_rdf_triplets.")
+
+
+def add_format_arguments(parser):
+    parser.add_argument("--format", choices=FORMATS, default="json", help="json files, memory mappable npy columns or parquet tables")
+    parser.add_argument("--compression", default="zstd", help="parquet compression codec (npy columns stay uncompressed to be memory mapped)")
@@ -1,41 +1,36 @@
-import argparse, json, re, sys
+import argparse, json, sys
+import numpy as np
 sys.path.append("../")
 
-from get_descriptions_and_labels import load_entities
-from to_graph import dump_graph
+from text_index import iter_id_text, open_text_index
+from to_graph import load_entities, stream_rdf_triplets
+from triple_store import TripleStore
 
+from formats import FORMATS, add_format_arguments, read_records, write_index, write_records, write_triplets
 from pathlib import Path
 from sklearn.model_selection import train_test_split
 
 
-def load(filename, as_list=True):
+def load(filename, as_list=True, entities=None, index=False):
+    # `id text` lines, every text of an id as a list or the last one, only for the given entities if any;
+    # with index the entities are looked up through a key -> offset index of the file instead of a full read
+    if index and entities is not None:
+        with open_text_index(filename) as text_index:
+            return text_index.get_many(entities, as_list=as_list)
     _dict = {}
-    with open(filename, "r") as f:
-        for line in f.read().split("\n"):
-            if len(line) <= 1:
-                continue
-            _match = re.search("[QP][0-9]+ ", line)
-            _id = line[:_match.span()[1] - 1]
-            data = line[_match.span()[1]:]
-            if as_list:
-                if _id in _dict:
-                    _dict[_id].append(data)
-                else:
-                    _dict[_id] = [data]
+    for _id, data in iter_id_text(filename, entities):
+        if as_list:
+            if _id in _dict:
+                _dict[_id].append(data)
             else:
-                _dict[_id] = data
+                _dict[_id] = [data]
+        else:
+            _dict[_id] = data
     return _dict
 
 
-def load_graph(filename):
-    edges = []
-    with open(filename, "r") as f:
-        for line in f.read().split("\n"):
-            if len(line) <= 1:
-                continue
-            head, rel, tail = line.split(" ")
-            edges.append((head, rel, tail))
-    return edges
+def load_graph(filename, entities=None, relations=None):
+    return list(stream_rdf_triplets(filename, entities=entities, relations=relations))
 
 def prepare_pretraining_data(ents):
     global descriptions, names, entities
@@ -70,46 +65,53 @@ def extract_entities_from_disamb_data(data):
     return ents
 
 
-def cut_dataset(dataset, graph, entities, base_dir, el_data):
-    edges = dict(zip(graph.copy(), range(len(graph))))
+def cut_edges(graph, removed: set) -> tuple[list[tuple], dict]:
+    # distinct triplets without the removed entities, in their original order, with a mask over the
+    # integer edge arrays instead of a scan of all the edges per removed entity
+    store = TripleStore.from_triplets(graph)
+    heads, rels, tails = store.heads, store.rels, store.tails
+    # the rows themselves as keys, a single integer key would overflow on large graphs
+    _, first = np.unique(np.stack([heads, rels, tails], 1), axis=0, return_index=True)
+    keep = np.zeros(len(store), dtype=bool)
+    keep[first] = True
+    ent_mask = store.entity_mask(removed)
+    rel_mask = np.asarray([r in removed for r in store.idx2rel], dtype=bool)
+    keep &= ~(ent_mask[heads] | ent_mask[tails] | rel_mask[rels])
+    edges = list(store.select(keep))
+    relations = {triplet[1] for triplet in edges}
+    return edges, dict(zip(relations, range(len(relations))))
+
+
+def cut_dataset(dataset, graph, entities, base_dir, el_data, suffix="", cut=None, fmt="json", compression="zstd"):
+    # drop the entities without a meaningful description from every set, and their edges from the graph;
+    # the cut graph and indices are returned so that cutting another split of the same entities reuses them
+    removed = set()
+    cut_data = {}
     for _set in ("train", "dev", "test"):
-        elements_to_delete = []
+        cut_data[_set] = {}
         for _id, metadata in dataset[_set].items():
             if metadata["caption"] == "None" or "Wikimedia" in metadata["caption"]:
-                elements_to_delete.append(_id)
-        edges_to_delete = []
-        for el in elements_to_delete:
-            dataset[_set].pop(el)
-            entities.pop(el, None)
-            for edge in edges:
-                if el in edge:
-                    edges_to_delete.append(edge)
-        for edge in edges_to_delete:
-            edges.pop(edge, None)
-                    
-        with open(f"{base_dir}-cut/pretraining/{_set}.json", "w") as f:
-            json.dump(dataset[_set], f, indent=2)
-
-    edges = list(edges)
-    dump_graph(edges, f"{base_dir}-cut/link-prediction/train.txt")
-
-    entities = dict(zip(entities, range(len(entities))))
-    relations = {triplet[1] for triplet in edges}
-    relations = dict(zip(relations, range(len(relations))))
-    with open(f"{base_dir}-cut/ent2idx.json", "w") as f:
-        json.dump(entities, f, indent=2)
+                removed.add(_id)
+            else:
+                cut_data[_set][_id] = metadata
 
-    with open(f"{base_dir}-cut/rel2idx.json", "w") as f:
-        json.dump(relations, f, indent=2)
+        write_records(cut_data[_set], f"{base_dir}-cut/pretraining/{_set}{suffix}", fmt, compression)
 
-    # dump the cut Entity-Linking data
-    el_data = [item for item in el_data if item["correct_id"] in entities]
-    with open(f"{base_dir}-cut/entity-linking/test.json", "w") as f:
-        json.dump(el_data, f, indent=2)
+    if cut is None or cut["removed"] != removed:
+        edges, relations = cut_edges(graph, removed)
+        entities = [e for e in entities if e not in removed]
+        entities = dict(zip(entities, range(len(entities))))
+        # the cut Entity-Linking data
+        el_data = [item for item in el_data if item["correct_id"] in entities]
+        cut = {"removed": removed, "edges": edges, "entities": entities, "relations": relations, "el_data": el_data}
 
+        write_triplets(edges, entities, relations, f"{base_dir}-cut/link-prediction/train", fmt, compression)
+        write_index(entities, f"{base_dir}-cut/ent2idx", fmt, compression)
+        write_index(relations, f"{base_dir}-cut/rel2idx", fmt, compression)
+        write_records(el_data, f"{base_dir}-cut/entity-linking/test", fmt, compression)
+    return cut
 
 
-        
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
@@ -118,6 +120,10 @@ if __name__ == "__main__":
     parser.add_argument("--names", default="./corrected/labels.txt")
     parser.add_argument("--graph", default="./corrected/graph.txt")
     parser.add_argument("--wikipedia")
+    parser.add_argument("--corrected-format", choices=FORMATS, default="json", help="format of the corrected sets written by correct.py")
+    add_format_arguments(parser)
+    parser.add_argument("--index", action="store_true", help="look the names up through an offset index of the file (e.g. the names of a full dump) instead of reading it")
+    parser.add_argument("--stats", default="descriptions_stats.json", help="json file for the counts of the descriptions")
 
     args = parser.parse_args()
 
@@ -129,9 +135,10 @@ if __name__ == "__main__":
         Path(f"{base_dir + s}/link-prediction").mkdir(parents=True, exist_ok=True)
         Path(f"{base_dir + s}/entity-linking").mkdir(parents=True, exist_ok=True)
     
-    descriptions = load(args.descriptions)
-    names = load(args.names)
     entities = load_entities(args.entities)
+    descriptions = load(args.descriptions)
+    # only the names of the entities are used
+    names = load(args.names, entities=set(entities), index=args.index)
     graph = load_graph(args.graph)
     relations = {triplet[1] for triplet in graph}
     if args.wikipedia is not None:
@@ -150,33 +157,27 @@ if __name__ == "__main__":
         else:
             desc_stats[desc] = 1
     desc_stats = dict(sorted(desc_stats.items(), key=lambda x: x[1], reverse=True))
-    with open("descriptions_stats.json", "w") as f:
+    with open(args.stats, "w") as f:
         json.dump(desc_stats, f, indent=2)
 
     # load the dataset, prepare it and save it
     dataset = {}
     for _set in ("train", "dev", "test"):
-        with open(f"corrected/wikidata-disambig-{_set}.json", "r") as f:
-            data = json.load(f)
-            if _set == "test":
-                el_data = data.copy()
-                with open(f"{base_dir}/entity-linking/test.json", "w") as f:
-                    json.dump(el_data, f, indent=2)
+        data = read_records(f"corrected/wikidata-disambig-{_set}", args.corrected_format)
+        if _set == "test":
+            el_data = data.copy()
+            write_records(el_data, f"{base_dir}/entity-linking/test", args.format, args.compression)
         ents = extract_entities_from_disamb_data(data)
         dataset[_set] = prepare_pretraining_data(ents)
         
-        with open(f"{base_dir}/pretraining/{_set}_original.json", "w") as f:
-            json.dump(dataset[_set], f, indent=2)
+        write_records(dataset[_set], f"{base_dir}/pretraining/{_set}_original", args.format, args.compression)
 
     # prepare and save the entity and relation indices
     entities = dict(zip(entities, range(len(entities))))
     relations = dict(zip(relations, range(len(relations))))
     
-    with open(f"{base_dir}/ent2idx.json", "w") as f:
-        json.dump(entities, f, indent=2)
-
-    with open(f"{base_dir}/rel2idx.json", "w") as f:
-        json.dump(relations, f, indent=2)
+    write_index(entities, f"{base_dir}/ent2idx", args.format, args.compression)
+    write_index(relations, f"{base_dir}/rel2idx", args.format, args.compression)
 
     # generate and save a better split
     complete = dict([item for s in ("train", "dev", "test") for item in dataset[s].items()])
@@ -185,10 +186,9 @@ if __name__ == "__main__":
     new_dataset = {"train": dict(new_train), "dev": dict(new_dev), "test": dict(new_test)}
 
     for _set in ("train", "dev", "test"):
-        with open(f"{base_dir}/pretraining/{_set}.json", "w") as f:
-            json.dump(new_dataset[_set], f, indent=2)
+        write_records(new_dataset[_set], f"{base_dir}/pretraining/{_set}", args.format, args.compression)
 
     # cut (and dump) the original dataset
-    cut_dataset(dataset, graph, entities, base_dir, el_data)
-    # cut (and dump) the better split dataset
-    cut_dataset(dataset, graph, entities, base_dir, el_data)
+    cut = cut_dataset(dataset, graph, entities, base_dir, el_data, suffix="_original", fmt=args.format, compression=args.compression)
+    # cut (and dump) the better split dataset, same entities: the cut graph and indices are reused
+    cut_dataset(new_dataset, graph, entities, base_dir, el_data, cut=cut, fmt=args.format, compression=args.compression)
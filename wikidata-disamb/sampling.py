@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class NegativeSampler:
+    # random entities to use as wrong ids: the candidates are stored once in an array and the draws are made
+    # in blocks, so that every sample costs O(1) (rejecting the excluded id) instead of a copy of the candidates;
+    # optionally weighted (e.g. by degree in the graph) and restricted to the candidates of a given group (e.g.
+    # the entities of the same type)
+
+    def __init__(self, candidates, weights=None, groups: dict=None, seed: int=None, block: int=4096):
+        self.candidates = np.asarray(list(candidates), dtype=object)
+        if len(self.candidates) == 0:
+            raise RuntimeError("No candidates to sample from.")
+        self.cdf = None
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)
+            if len(weights) != len(self.candidates):
+                raise RuntimeError(f"{len(weights)} weights for {len(self.candidates)} candidates.")
+            self.cdf = np.cumsum(weights)
+            self.cdf /= self.cdf[-1]
+        self.rng = np.random.default_rng(seed)
+        self.block = block
+        self._draws = {}
+        # group -> indices of its candidates, the entities without a group are drawn from all the candidates
+        self.group_of = {}
+        self.groups = {}
+        if groups is not None:
+            index = {c: i for i, c in enumerate(self.candidates.tolist())}
+            members = {}
+            for entity, group in groups.items():
+                if entity in index:
+                    self.group_of[entity] = group
+                    members.setdefault(group, []).append(index[entity])
+            self.groups = {g: np.asarray(m, dtype=np.int64) for g, m in members.items()}
+
+    @classmethod
+    def from_graph(cls, candidates, triplets, weighting: str=None, type_relation: str=None, seed: int=None):
+        # weighting="degree" draws the entities proportionally to their degree (plus one, so that isolated
+        # entities can still be drawn), type_relation (e.g. P31) draws the negatives among the entities
+        # sharing the first type of the positive one
+        candidates = list(candidates)
+        index = {c: i for i, c in enumerate(candidates)}
+        degrees = np.ones(len(candidates), dtype=np.float64)
+        groups = {} if type_relation is not None else None
+        for head, rel, tail in triplets:
+            for e in (head, tail):
+                i = index.get(e)
+                if i is not None:
+                    degrees[i] += 1
+            if groups is not None and rel == type_relation:
+                groups.setdefault(head, tail)
+        if weighting not in (None, "uniform", "degree"):
+            raise RuntimeError(f"Unknown weighting: {weighting}, use `uniform` or `degree`.")
+        return cls(candidates, degrees if weighting == "degree" else None, groups, seed)
+
+    def _draw(self, group) -> int:
+        # index of the next random candidate of the group, from a block drawn beforehand
+        draws = self._draws.get(group)
+        if draws is None or len(draws[0]) == draws[1]:
+            members = self.groups.get(group)
+            if members is None:
+                if self.cdf is None:
+                    indices = self.rng.integers(len(self.candidates), size=self.block)
+                else:
+                    indices = np.searchsorted(self.cdf, self.rng.random(self.block), side="right")
+            elif self.cdf is None:
+                indices = members[self.rng.integers(len(members), size=self.block)]
+            else:
+                cdf = np.cumsum(np.diff(self.cdf, prepend=0.)[members])
+                indices = members[np.searchsorted(cdf, self.rng.random(self.block) * cdf[-1], side="right")]
+            draws = [np.minimum(indices, len(self.candidates) - 1).tolist(), 0]
+            self._draws[group] = draws
+        draws[1] += 1
+        return draws[0][draws[1] - 1]
+
+    def sample(self, exclude: str=None, like: str=None, max_rejections: int=1000) -> str:
+        # a random candidate other than exclude, of the same group as like if it has one
+        group = self.group_of.get(like)
+        if group is not None and len(self.groups[group]) == 1 and self.candidates[self.groups[group][0]] == exclude:
+            group = None
+        for _ in range(max_rejections):
+            candidate = self.candidates[self._draw(group)]
+            if candidate != exclude:
+                return candidate
+        raise RuntimeError(f"Could not draw a candidate other than {exclude} in {max_rejections} attempts.")
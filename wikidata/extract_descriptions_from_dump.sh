@@ -1,6 +1,6 @@
 #!/bin/bash
 
-regex="<http:\/\/www\.wikidata\.org\/entity\/Q[0-9]+> <http:\/\/schema\.org\/description> \".+\"@en"
+# single output wrapper around extract_from_dump.py, which can write triplets, names, descriptions, redirections and sitelinks in one pass
 
 outfile=$1
 
@@ -9,4 +9,4 @@ then
 	outfile="descriptions.txt"
 fi
 
-bzgrep -e "$regex" latest-truthy.nt.bz2 | sed "s/<http:\/\/www\.wikidata\.org\/entity\///g" | sed "s/<http:\/\/schema\.org\/description>//g" | sed "s/>//g" | sed "s/\"//g" | sed "s/@en[-a-z ]*//g" > "$outfile"
+python "$(dirname "$0")/extract_from_dump.py" --dump latest-truthy.nt.bz2 --triplets "" --names "" --descriptions "$outfile" --redirections "" --sitelinks ""
@@ -0,0 +1,224 @@
+import argparse, bz2, os, re, time
+
+from multiprocessing import Pool
+
+
+# bzip2 blocks are bit aligned: each one starts with the 48 bit magic 0x314159265359 (pi) and the last
+# block of every stream is followed by the end of stream magic 0x177245385090 (sqrt(pi)) and the stream crc
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+
+WD_ENTITY = r"<http://www\.wikidata\.org/entity/(Q[0-9]+)>"
+TRIPLET_REGEX = re.compile(
+    rf"^{WD_ENTITY} <http://www\.wikidata\.org/prop/direct/(P[0-9]+)> {WD_ENTITY} \.$",
+    re.M
+)
+NAME_REGEX = re.compile(rf"^{WD_ENTITY} <http://schema\.org/name> \"(.*)\"@en \.$", re.M)
+DESCRIPTION_REGEX = re.compile(rf"^{WD_ENTITY} <http://schema\.org/description> \"(.*)\"@en \.$", re.M)
+REDIRECTION_REGEX = re.compile(rf"^{WD_ENTITY} <http://www\.w3\.org/2002/07/owl#sameAs> {WD_ENTITY} \.$", re.M)
+SITELINK_REGEX = re.compile(rf"^<(https://en\.wikipedia\.org/wiki/[^>]*)> <http://schema\.org/about> {WD_ENTITY} \.$", re.M)
+ESCAPE_REGEX = re.compile(r"\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)")
+ESCAPES = {"t": " ", "n": " ", "r": " ", "b": "", "f": "", '"': '"', "'": "'", "\\": "\\"}
+
+
+def _magic_patterns(magic: int) -> list[tuple]:
+    # one pattern per bit shift: the fully determined bytes to search for and the masks to verify the rest
+    patterns = []
+    for shift in range(8):
+        window = (magic << (8 - shift)).to_bytes(7, "big")
+        mask = (((1 << 48) - 1) << (8 - shift)).to_bytes(7, "big")
+        first = 0 if mask[0] == 0xff else 1
+        patterns.append((shift, window, mask, first))
+    return patterns
+
+
+BLOCK_PATTERNS = _magic_patterns(BLOCK_MAGIC)
+EOS_PATTERNS = _magic_patterns(EOS_MAGIC)
+
+
+def _find_magic(data: bytes, patterns: list[tuple], limit: int) -> list[int]:
+    # bit offsets (relative to data) of every occurrence of the magic starting before byte `limit`
+    offsets = []
+    for shift, window, mask, first in patterns:
+        key = window[first:6]
+        pos = data.find(key, first)
+        while pos != -1:
+            start = pos - first
+            if start < limit and start + 7 <= len(data) and all(
+                data[start + j] & mask[j] == window[j] for j in range(7)
+            ):
+                offsets.append(start * 8 + shift)
+            pos = data.find(key, pos + 1)
+    return offsets
+
+
+def find_blocks(path: str, chunksize: int=1 << 26):
+    # yield the (start, end) bit ranges of all the bzip2 blocks in the file
+    size = os.path.getsize(path)
+    start = None
+    with open(path, "rb") as f:
+        for offset in range(0, size, chunksize):
+            f.seek(offset)
+            data = f.read(chunksize + 7)
+            limit = min(chunksize, len(data))
+            blocks = [(b, True) for b in _find_magic(data, BLOCK_PATTERNS, limit)]
+            ends = [(e, False) for e in _find_magic(data, EOS_PATTERNS, limit)]
+            for bit, is_block in sorted(blocks + ends):
+                bit += offset * 8
+                if start is not None:
+                    yield start, bit
+                start = bit if is_block else None
+
+
+def decompress_block(path: str, start: int, end: int) -> bytes:
+    # rebuild a standalone single block stream: header, block, end of stream magic and the
+    # combined crc, which for a single block is the block crc itself
+    with open(path, "rb") as f:
+        f.seek(start // 8)
+        data = f.read((end + 7) // 8 - start // 8)
+    n_bits = end - start
+    block = int.from_bytes(data, "big") >> (len(data) * 8 - start % 8 - n_bits)
+    block &= (1 << n_bits) - 1
+    crc = (block >> (n_bits - 80)) & 0xffffffff
+    stream = (int.from_bytes(b"BZh9", "big") << n_bits) | block
+    stream = (((stream << 48) | EOS_MAGIC) << 32) | crc
+    n_bits += 32 + 48 + 32
+    padding = -n_bits % 8
+    return bz2.decompress((stream << padding).to_bytes((n_bits + padding) // 8, "big"))
+
+
+def _unescape(text: str) -> str:
+    if "\\" not in text:
+        return text
+    def replace(match):
+        escaped = match.group(1)
+        if len(escaped) > 1:
+            return chr(int(escaped[1:], 16))
+        return ESCAPES.get(escaped, escaped)
+    return ESCAPE_REGEX.sub(replace, text)
+
+
+def parse_ntriples(text: str) -> tuple[str, str, str, str, str]:
+    triplets = "".join(f"{h} {r} {t}\n" for h, r, t in TRIPLET_REGEX.findall(text))
+    names = "".join(f"{e} {_unescape(n)}\n" for e, n in NAME_REGEX.findall(text))
+    descriptions = "".join(f"{e} {_unescape(d)}\n" for e, d in DESCRIPTION_REGEX.findall(text))
+    redirections = "".join(f"{e} {r}\n" for e, r in REDIRECTION_REGEX.findall(text))
+    sitelinks = "".join(f"{e} {l}\n" for l, e in SITELINK_REGEX.findall(text))
+    return triplets, names, descriptions, redirections, sitelinks
+
+
+def process_block(args: tuple) -> tuple:
+    # lines crossing the block boundaries are returned as raw bytes and stitched back together in order
+    path, start, end = args
+    try:
+        data = decompress_block(path, start, end)
+    except (OSError, ValueError):
+        # a false positive magic inside the compressed data splits a block in two: let the caller merge it
+        return None
+    first_newline = data.find(b"\n")
+    last_newline = data.rfind(b"\n")
+    if first_newline == -1:
+        return data, ("",) * 5, None, (end - start) // 8
+    return (
+        data[:first_newline + 1],
+        parse_ntriples(data[first_newline + 1:last_newline + 1].decode("utf-8", errors="replace")),
+        data[last_newline + 1:],
+        (end - start) // 8
+    )
+
+
+def _merged_blocks(path: str, pool: Pool, workers: int):
+    # decompress the blocks in parallel, merging back the ranges split by false positive magics
+    blocks = find_blocks(path)
+    pending = None
+    while True:
+        batch = [b for _, b in zip(range(4 * workers), blocks)]
+        if len(batch) == 0:
+            break
+        results = pool.map(process_block, [(path, s, e) for s, e in batch])
+        for (start, end), result in zip(batch, results):
+            if pending is not None:
+                start = pending
+                result = process_block((path, start, end))
+            if result is None:
+                pending = start
+                continue
+            pending = None
+            yield result
+    if pending is not None:
+        raise RuntimeError(f"Corrupted bzip2 data starting at bit {pending}.")
+
+
+def extract(path: str, outfiles: tuple, workers: int=os.cpu_count()):
+    handles = [open(o, "w") if o else None for o in outfiles]
+    counts = [0] * len(outfiles)
+    size = os.path.getsize(path)
+    processed = 0
+    start = time.time()
+
+    def write(parsed):
+        for i, (handle, text) in enumerate(zip(handles, parsed)):
+            if handle is not None and len(text) > 0:
+                handle.write(text)
+                counts[i] += text.count("\n")
+
+    with Pool(workers) as pool:
+        carry = b""
+        for head, parsed, tail, n_bytes in _merged_blocks(path, pool, workers):
+            processed += n_bytes
+            if tail is None:
+                # the whole block is in the middle of a line
+                carry += head
+                continue
+            write(parse_ntriples((carry + head).decode("utf-8", errors="replace")))
+            write(parsed)
+            carry = tail
+            elapsed = time.time() - start
+            print(
+                f"> Extracting from {path}: {100 * processed / size:.1f}% ({processed / elapsed / 2**20:.1f} MB/s compressed) | triplets: {counts[0]}, names: {counts[1]}, descriptions: {counts[2]}, redirections: {counts[3]}, sitelinks: {counts[4]}",
+                end="\r"
+            )
+        write(parse_ntriples(carry.decode("utf-8", errors="replace")))
+    for handle in handles:
+        if handle is not None:
+            handle.close()
+    print(f"\n> Done in {time.time() - start:.1f}s.")
+
+
+def extract_sequential(path: str, outfiles: tuple, chunksize: int=1 << 24):
+    handles = [open(o, "w") if o else None for o in outfiles]
+    start = time.time()
+    processed = 0
+    with bz2.open(path, "rt", encoding="utf-8", errors="replace") as f:
+        while True:
+            lines = f.readlines(chunksize)
+            if len(lines) == 0:
+                break
+            text = "".join(lines)
+            processed += len(text)
+            for handle, out in zip(handles, parse_ntriples(text)):
+                if handle is not None:
+                    handle.write(out)
+            print(f"> Extracting from {path}: {processed / (time.time() - start) / 2**20:.1f} MB/s uncompressed", end="\r")
+    for handle in handles:
+        if handle is not None:
+            handle.close()
+    print(f"\n> Done in {time.time() - start:.1f}s.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dump", default="latest-truthy.nt.bz2")
+    parser.add_argument("--triplets", default="rdf_triplets.txt", help="pass an empty string to skip")
+    parser.add_argument("--names", default="names.txt", help="pass an empty string to skip")
+    parser.add_argument("--descriptions", default="descriptions.txt", help="pass an empty string to skip")
+    parser.add_argument("--redirections", default="redirections.txt", help="pass an empty string to skip")
+    parser.add_argument("--sitelinks", default="sitelinks.txt", help="english wikipedia pages, pass an empty string to skip")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    outfiles = (args.triplets, args.names, args.descriptions, args.redirections, args.sitelinks)
+    if args.workers > 1:
+        extract(args.dump, outfiles, args.workers)
+    else:
+        extract_sequential(args.dump, outfiles)
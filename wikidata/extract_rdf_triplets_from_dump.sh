@@ -1,11 +1,12 @@
 #!/bin/bash
 
+# single output wrapper around extract_from_dump.py, which can write triplets, names, descriptions, redirections and sitelinks in one pass
+
 outfile=$1
-regex="<http:\/\/www\.wikidata\.org\/entity\/Q[0-9]+> <http:\/\/www\.wikidata\.org\/prop\/direct\/P[0-9]+> <http:\/\/www\.wikidata\.org\/entity\/Q[0-9]+> \."
 
 if [ -z "$outfile" ]
 then
 	outfile="rdf_triplets.txt"
 fi
 
-bzgrep -e "$regex" latest-truthy.nt.bz2 | sed "s/<http:\/\/www\.wikidata\.org\/entity\///g" | sed "s/<http:\/\/www\.wikidata\.org\/prop\/direct\///g" | sed "s/>//g" | sed "s/ \.//g" > "$outfile"
+python "$(dirname "$0")/extract_from_dump.py" --dump latest-truthy.nt.bz2 --triplets "$outfile" --names "" --descriptions "" --redirections "" --sitelinks ""
@@ -0,0 +1,75 @@
+import argparse, os, shutil, sys, time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from multiprocessing import Pool
+
+from to_graph import load_entities, shard_rdf_file, stream_rdf_triplets
+
+
+def _init_worker(entities: frozenset):
+    global worker_entities
+    worker_entities = entities
+
+
+def filter_shard(args: tuple) -> int:
+    path, start, end, both_ends, outfile = args
+    n_triplets = 0
+    with open(outfile, "w") as f:
+        for triplet in stream_rdf_triplets(path, entities=worker_entities, both_ends=both_ends, start=start, end=end):
+            f.write(" ".join(triplet) + "\n")
+            n_triplets += 1
+    return n_triplets
+
+
+def expand_shard(args: tuple) -> set[str]:
+    path, start, end = args
+    neighbours = set()
+    for head, _, tail in stream_rdf_triplets(path, entities=worker_entities, both_ends=False, start=start, end=end):
+        neighbours.add(head)
+        neighbours.add(tail)
+    return neighbours - worker_entities
+
+
+def expand_entities(path: str, entities: frozenset, hops: int, workers: int) -> frozenset:
+    shards = shard_rdf_file(path, workers)
+    for hop in range(hops):
+        start = time.time()
+        with Pool(workers, initializer=_init_worker, initargs=(entities,)) as p:
+            new_entities = set().union(*p.map(expand_shard, [(path, s, e) for s, e in shards]))
+        entities = entities | new_entities
+        print(f"> Hop {hop + 1}: {len(new_entities)} new entities, {len(entities)} in total ({time.time() - start:.1f}s)")
+        if len(new_entities) == 0:
+            break
+    return entities
+
+
+def filter_rdf_triplets(path: str, entities: frozenset, outfile: str, both_ends: bool=True, workers: int=os.cpu_count()) -> int:
+    # every worker streams its own byte range of the file into a part file, which are then concatenated in order
+    start = time.time()
+    shards = shard_rdf_file(path, workers)
+    parts = [f"{outfile}.part{i}" for i in range(len(shards))]
+    with Pool(workers, initializer=_init_worker, initargs=(entities,)) as p:
+        counts = p.map(filter_shard, [(path, s, e, both_ends, part) for (s, e), part in zip(shards, parts)])
+    with open(outfile, "wb") as out:
+        for part in parts:
+            with open(part, "rb") as f:
+                shutil.copyfileobj(f, out)
+            os.remove(part)
+    print(f"> Kept {sum(counts)} triplets in {time.time() - start:.1f}s: {outfile}")
+    return sum(counts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entities")
+    parser.add_argument("--triplets", default="rdf_triplets.txt")
+    parser.add_argument("--outfile", default="filtered_rdf_triplets.txt")
+    parser.add_argument("--mode", choices=("both", "either", "khop"), default="both", help="keep the triplets with both ends, either end or both ends in the k-hop neighbourhood of the entities")
+    parser.add_argument("--hops", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    entities = frozenset(load_entities(args.entities))
+    if args.mode == "khop":
+        entities = expand_entities(args.triplets, entities, args.hops, args.workers)
+    filter_rdf_triplets(args.triplets, entities, args.outfile, both_ends=args.mode != "either", workers=args.workers)
@@ -2,7 +2,12 @@
 
 ents_file=$1
 triplets=$2
+# both, either or khop (see filter_rdf_triplets.py)
+mode=$3
 
-new_triplets=$(grep -wf $ents_file $triplets)
+if [ -z "$mode" ]
+then
+	mode="either"
+fi
 
-printf "$new_triplets" > "filtered_rdf_triplets.txt"
+python "$(dirname "$0")/filter_rdf_triplets.py" --entities "$ents_file" --triplets "$triplets" --mode "$mode" --outfile "filtered_rdf_triplets.txt"
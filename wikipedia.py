@@ -0,0 +1,82 @@
+import time
+
+from urllib.parse import quote, unquote
+
+from cache import get_cache
+from http_client import HTTPClient, HTTPError
+
+
+SUMMARY_API = "https://en.wikipedia.org/api/rest_v1/page/summary/"
+
+
+def summary_url(link: str) -> str:
+    # the title of the sitelink encoded as a single path segment: a "/" in it (AC/DC) must be sent as %2F,
+    # the api answers 404 otherwise; decoded first, the sitelinks may already be (partly) url encoded
+    return SUMMARY_API + quote(unquote(link.split("/wiki/", 1)[1]), safe="")
+
+
+class WikipediaFetcher:
+    # plain text lead section of the wikipedia pages, from the REST summary api, through one persistent
+    # connection pool for the whole run and the persistent cache
+
+    def __init__(self, concurrency: int=10, rate: float=20., max_retries: int=5, chunksize: int=500):
+        self.client = HTTPClient(
+            concurrency=concurrency,
+            rate=rate,
+            max_retries=max_retries,
+            headers={"Accept": "application/json"}
+        )
+        self.chunksize = chunksize
+        self.fetched = 0
+        self.cached = 0
+        self.failed = 0
+        self.seconds = 0.
+
+    def _fetch(self, links: list[str]) -> dict:
+        cache = get_cache()
+        extracts = cache.get_many("wikipedia_extract", links)
+        missing = [l for l in links if l not in extracts]
+        self.cached += len(extracts)
+        start = time.time()
+        fresh = {}
+        for link, summary in zip(missing, self.client.imap_get(map(summary_url, missing))):
+            if isinstance(summary, HTTPError):
+                # not cached, the next run tries again
+                print(f"> {summary.status}: failed to fetch {link}")
+                self.failed += 1
+                continue
+            # pages that do not exist (anymore) have no extract
+            fresh[link] = summary.get("extract") if summary is not None else None
+        cache.put_many("wikipedia_extract", fresh)
+        self.fetched += len(missing)
+        self.seconds += time.time() - start
+        extracts.update(fresh)
+        return extracts
+
+    def imap(self, links):
+        # extract of every link in order, None for the entities without a page or whose page failed
+        links = list(links)
+        for i in range(0, len(links), self.chunksize):
+            chunk = links[i:i + self.chunksize]
+            extracts = self._fetch([l for l in dict.fromkeys(chunk) if l is not None])
+            for link in chunk:
+                yield extracts.get(link)
+
+    def fetch(self, links: list[str]) -> list[str]:
+        return list(self.imap(links))
+
+    def report(self):
+        rate = self.fetched / self.seconds if self.seconds > 0 else 0.
+        print(f"> Wikipedia: {self.fetched} pages fetched ({self.failed} failed) at {rate:.1f} pages/s, {self.cached} from the cache")
+
+    def close(self):
+        self.client.close()
+
+
+def add_wikipedia_arguments(parser):
+    parser.add_argument("--wiki-concurrency", type=int, default=10, help="maximum number of wikipedia requests in flight")
+    parser.add_argument("--wiki-rate", type=float, default=20., help="maximum number of wikipedia requests per second")
+
+
+def fetcher_from_args(args) -> WikipediaFetcher:
+    return WikipediaFetcher(concurrency=args.wiki_concurrency, rate=args.wiki_rate)